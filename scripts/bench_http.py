@@ -0,0 +1,117 @@
+"""
+HTTP バックエンドのスループット比較（ローカルのテストサーバを使用）
+
+  python scripts/bench_http.py --requests 500 --concurrency 16 --delay 0.02
+
+・requests バックエンド → ローカルの HTTP/1.1 サーバ（ThreadingHTTPServer）
+・httpx バックエンド   → 同じ内容を返すローカルの HTTP/2 (h2c, prior knowledge) サーバ
+  ※ HTTP/2 側は pip install 'httpx[http2]' が必要（h2 を使ってサーバも立てる）
+--url を指定するとローカルサーバの代わりにそのURLへ両バックエンドで投げる。
+"""
+import os, sys, time, argparse, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# レート制限/適応制御は計測の邪魔なので切る（scrape の import 前に設定する）
+os.environ.setdefault("REQUESTS_PER_SEC", "0")
+os.environ.setdefault("ADAPTIVE_CONCURRENCY", "false")
+os.environ.setdefault("HTTP_POOL_MAXSIZE", "16")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scrape  # noqa: E402
+
+BODY = b"<html><head><title>bench</title></head><body>" + b"x" * 2000 + b"</body></html>"
+
+# ---- HTTP/1.1 server ----
+def start_http11_server(delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{srv.server_address[1]}/"
+
+# ---- HTTP/2 (h2c) server ----
+def start_h2_server(delay):
+    import h2.config, h2.connection, h2.events
+
+    class H2Protocol(asyncio.Protocol):
+        def connection_made(self, transport):
+            self.transport = transport
+            self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+            self.conn.initiate_connection()
+            transport.write(self.conn.data_to_send())
+
+        def data_received(self, data):
+            for ev in self.conn.receive_data(data):
+                if isinstance(ev, h2.events.StreamEnded):
+                    asyncio.ensure_future(self.respond(ev.stream_id))
+            self.transport.write(self.conn.data_to_send())
+
+        async def respond(self, stream_id):
+            await asyncio.sleep(delay)
+            self.conn.send_headers(stream_id, [
+                (":status", "200"), ("content-type", "text/html"), ("content-length", str(len(BODY))),
+            ])
+            while self.conn.local_flow_control_window(stream_id) < len(BODY):
+                await asyncio.sleep(0.001)
+            self.conn.send_data(stream_id, BODY, end_stream=True)
+            self.transport.write(self.conn.data_to_send())
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(H2Protocol, "127.0.0.1", 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+
+# ---- bench ----
+def run(backend, url, n, concurrency):
+    scrape._backend = backend
+    scrape.HTTP_VERSIONS.clear()
+
+    def one(i):
+        r = scrape.http_request("GET", f"{url}?i={i}", timeout=(5, 15))
+        return len(r.content)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        total = sum(ex.map(one, range(n)))
+    elapsed = time.perf_counter() - t0
+    print(f"{backend.name:>8} {dict(scrape.HTTP_VERSIONS)!s:<22} {n / elapsed:8.1f} req/s "
+          f"{elapsed:6.2f}s {total / 1024:8.0f} KiB")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--delay", type=float, default=0.02, help="server-side latency per response (sec)")
+    ap.add_argument("--url", default="", help="benchmark this URL instead of the local servers")
+    args = ap.parse_args()
+
+    scrape.CONCURRENCY.limit = scrape.CONCURRENCY.maximum = args.concurrency
+
+    http11_url = args.url or start_http11_server(args.delay)
+    run(scrape.RequestsBackend(), http11_url, args.requests, args.concurrency)
+    try:
+        if args.url:
+            backend, h2_url = scrape.HttpxBackend(), args.url
+        else:
+            backend, h2_url = scrape.HttpxBackend(http1=False), start_h2_server(args.delay)
+    except ImportError:
+        print("   httpx skipped (pip install 'httpx[http2]')")
+        return
+    run(backend, h2_url, args.requests, args.concurrency)
+
+if __name__ == "__main__":
+    main()
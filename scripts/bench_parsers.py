@@ -0,0 +1,104 @@
+"""
+HTML パーサ（BeautifulSoup のツリービルダー）の抽出一致チェックと速度比較
+
+  python scripts/bench_parsers.py                      # tests/fixtures/pages のページで比較（CI の切り替えゲート）
+  python scripts/bench_parsers.py --dir .cache/http --repeat 5   # 手元の HttpCache に保存したページで比較
+  python scripts/bench_parsers.py --modes full,partial      # SoupStrainer の部分パースも比較
+
+・保存済みページ（HttpCache の *.html、または任意の *.html）を parse_page + parse_breadcrumbs +
+  詳細補完（extract_menus/hours_from_scope）と一覧のリンク抽出に パーサ × PARSE_MODE ごとに通し、
+  抽出結果がすべて一致するかを確認する（不一致があれば終了コード 1）
+・既定はリポジトリの tests/fixtures/pages（一覧1枚 + クリニック3枚、元 URL は *.json）
+・1ページあたりのパース時間（soup 構築のみ / 抽出まで）と木のタグ数を表示する
+メニュー詳細の追跡（MENU_IMG_FOLLOW）は切ってあるのでネットワークには出ない。
+"""
+import os, sys, json, time, argparse
+from glob import glob
+
+os.environ["MENU_IMG_FOLLOW"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scrape  # noqa: E402
+
+FIXTURES = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests", "fixtures"))
+
+def load_pages(root):
+    """(url, html) の一覧。HttpCache のメタ（*.json）があれば元の URL を使う"""
+    pages = []
+    for body_path in sorted(glob(os.path.join(root, "**", "*.html"), recursive=True)):
+        url = "file://" + os.path.abspath(body_path)
+        meta_path = body_path[:-len(".html")] + ".json"
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                url = json.load(f).get("url") or url
+        with open(body_path, encoding="utf-8") as f:
+            pages.append((url, f.read()))
+    return pages
+
+def extract(url, html):
+    cards, soup = scrape.parse_page(html, url)
+    listing = scrape.make_document(html, listing=True)  # フロンティアが辿るリンク（一覧用の木）
+    return {"cards": cards, "breadcrumbs": scrape.parse_breadcrumbs(soup, url),
+            "menus": scrape.extract_menus_from_scope(soup, base_url=url),
+            "hours": scrape.extract_hours_from_scope(soup),
+            "links": list(scrape.listing_clinic_links(listing, url)) + list(scrape.frontier_links(listing, url))}
+
+def bench(parser, mode, pages, repeat):
+    scrape.SOUP_PARSER = parser
+    scrape.EXTRACT_STRAINER = scrape.RegionStrainer() if mode == "partial" else None
+    scrape.LISTING_STRAINER = scrape.RegionStrainer(links=True) if mode == "partial" else None
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        soups = [scrape.make_soup(html, parse_only=scrape.EXTRACT_STRAINER) for _, html in pages]
+    soup_ms = (time.perf_counter() - t0) * 1000 / (repeat * len(pages))
+    tags = sum(len(soup.find_all(True)) for soup in soups) / len(pages)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        results = [extract(url, html) for url, html in pages]
+    extract_ms = (time.perf_counter() - t0) * 1000 / (repeat * len(pages))
+    return results, soup_ms, extract_ms, tags
+
+def available_parsers(names):
+    found = []
+    for name in names:
+        try:
+            scrape.make_soup("<p></p>", name)
+            found.append(name)
+        except Exception:
+            print(f"{name:>12} skipped (not installed)")
+    return found
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dir", default=os.path.join(FIXTURES, "pages"), help="directory with saved *.html pages")
+    ap.add_argument("--parsers", default="html.parser,lxml")
+    ap.add_argument("--modes", default="full,partial", help="PARSE_MODE values to compare")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pages = load_pages(args.dir)
+    if not pages:
+        raise SystemExit(f"No *.html under {args.dir} (for .cache/http run scrape.py with HTTP_CACHE=true first)")
+    parsers = available_parsers(args.parsers.split(","))
+    print(f"{len(pages)} pages from {args.dir}")
+
+    baseline = None
+    mismatches = 0
+    combos = [(parser, mode) for parser in parsers for mode in args.modes.split(",")]
+    for parser, mode in combos:
+        results, soup_ms, extract_ms, tags = bench(parser, mode, pages, args.repeat)
+        label = f"{parser}/{mode}"
+        print(f"{label:>20} soup {soup_ms:7.2f} ms/page  extract {extract_ms:7.2f} ms/page  {tags:8.0f} tags/page")
+        if baseline is None:
+            baseline = (label, results)
+            continue
+        for (url, _), want, got in zip(pages, baseline[1], results):
+            if want != got:
+                mismatches += 1
+                print(f"  MISMATCH {baseline[0]} vs {label}: {url}")
+    if mismatches:
+        raise SystemExit(1)
+    print("parity: OK" if len(combos) > 1 else "parity: nothing to compare")
+
+if __name__ == "__main__":
+    main()
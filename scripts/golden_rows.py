@@ -0,0 +1,83 @@
+"""
+抽出エンジン（EXTRACT_ENGINE = bs4 / lexbor）の golden ファイル比較
+
+  python scripts/golden_rows.py                         # 各エンジンの CSV を golden とバイト単位で比較
+  python scripts/golden_rows.py --write                 # 抽出を変えたら bs4 で golden CSV を作り直してコミット
+  python scripts/golden_rows.py --dir .cache/http --golden .cache/golden --write   # 手元の保存ページで試す
+
+・既定はリポジトリの tests/fixtures/pages（*.html と元 URL の *.json）と tests/fixtures/golden
+・保存済みページ（HttpCache の *.html、または任意の *.html）を build_page_rows に通し、
+  save_outputs と同じ列・同じ to_csv で clinics / menus / hours の CSV を作る
+・timestamp は固定、ネットワークには出ない（メニュー詳細の追跡なし、未保存の詳細ページは取得しない）
+・1バイトでも違えば差分の先頭を表示して終了コード 1
+"""
+import os, sys, time, difflib, argparse
+
+os.environ["MENU_IMG_FOLLOW"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scrape  # noqa: E402
+from bench_parsers import load_pages, FIXTURES  # noqa: E402
+
+TS = "1970-01-01T00:00:00Z"
+SHEETS = {"clinics": scrape.CLINICS_HEADER, "menus": scrape.MENUS_HEADER, "hours": scrape.HOURS_HEADER}
+
+def render(engine, pages):
+    """engine で全ページを抽出し、シート名 → CSV バイト列 と 1ページあたりの処理時間を返す"""
+    scrape.EXTRACT_BACKEND = engine
+    scrape.DOCS = scrape.DocumentCache(1 << 40)   # 保存済みのクリニックページはすべて DOCS から引けるようにする
+    scrape.fetch_safe = lambda *args, **kwargs: ""
+    rows = {name: [] for name in SHEETS}
+    t0 = time.perf_counter()
+    docs = [(url, scrape.DOCS.parse(url, html)) for url, html in pages]
+    for url, doc in docs:
+        res = scrape.build_page_rows(url, url, doc, TS)
+        for name in SHEETS:
+            rows[name].extend(res[name])
+    ms = (time.perf_counter() - t0) * 1000 / len(pages)
+    csv = {name: scrape.pd.DataFrame(rows[name], columns=header).to_csv(index=False).encode("utf-8")
+           for name, header in SHEETS.items()}
+    return csv, ms
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dir", default=os.path.join(FIXTURES, "pages"), help="directory with saved *.html pages")
+    ap.add_argument("--golden", default=os.path.join(FIXTURES, "golden"), help="where golden CSVs are kept")
+    ap.add_argument("--engines", default="bs4,lexbor")
+    ap.add_argument("--write", action="store_true", help="(re)write golden CSVs with the first engine")
+    args = ap.parse_args()
+
+    pages = sorted(load_pages(args.dir))
+    if not pages:
+        raise SystemExit(f"No *.html under {args.dir}")
+    engines = [e for e in args.engines.split(",") if scrape.resolve_engine(e) == e]
+    print(f"{len(pages)} pages from {args.dir}")
+
+    if args.write:
+        csv, ms = render(engines[0], pages)
+        os.makedirs(args.golden, exist_ok=True)
+        for name, data in csv.items():
+            with open(os.path.join(args.golden, f"{name}.csv"), "wb") as f:
+                f.write(data)
+        print(f"[golden] wrote {args.golden} with {engines[0]} ({ms:.2f} ms/page)")
+        return
+
+    failed = False
+    for engine in engines:
+        csv, ms = render(engine, pages)
+        bad = []
+        for name, data in csv.items():
+            with open(os.path.join(args.golden, f"{name}.csv"), "rb") as f:
+                want = f.read()
+            if data != want:
+                bad.append(name)
+                diff = difflib.unified_diff(want.decode().splitlines(), data.decode().splitlines(),
+                                            f"golden/{name}.csv", f"{engine}/{name}.csv", lineterm="", n=0)
+                print("\n".join(list(diff)[:20]))
+        print(f"{engine:>8} {ms:7.2f} ms/page  {'MISMATCH ' + ','.join(bad) if bad else 'identical'}")
+        failed = failed or bool(bad)
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
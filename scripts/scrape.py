@@ -1,15 +1,115 @@
-import os, re, json, base64, time
+import os, re, sys, json, base64, time, threading, random, hashlib, shutil, tempfile, multiprocessing, zlib
+from glob import glob
+from collections import deque, OrderedDict
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timezone
-from urllib.parse import urljoin
+from email.utils import parsedate_to_datetime
+from html import unescape
+from urllib.parse import urljoin, urlsplit, urlunsplit
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
 
 # ---- Config ----
 USER_AGENT = "Mozilla/5.0 (compatible; ScraperBot/1.0; +https://github.com/your/repo)"
 TIMEOUT = 15           # 読み込みタイムアウト（秒）
-RETRY = 2              # リトライ回数
-SLEEP_BETWEEN = 2      # ページ間のポライトウェイト
+
+def env_int(name, default):
+    v = (os.getenv(name) or "").strip()
+    return int(v) if re.fullmatch(r"-?\d+", v) else default
+
+def env_float(name, default):
+    try:
+        return float((os.getenv(name) or "").strip())
+    except ValueError:
+        return default
+
+def env_bool(name, default):
+    v = (os.getenv(name) or "").strip().lower()
+    return v == "true" if v else default
+
+# ---- HTTP session (keep-alive / connection pool) ----
+HTTP_POOL_CONNECTIONS = env_int("HTTP_POOL_CONNECTIONS", 10)  # ホスト別プールの保持数
+HTTP_POOL_MAXSIZE = env_int("HTTP_POOL_MAXSIZE", 8)           # 1ホストあたりの最大コネクション数
+HTTP_POOL_BLOCK = env_bool("HTTP_POOL_BLOCK", True)           # 上限到達時は空きを待つ（per-host 上限を厳守）
+HTTP_KEEP_ALIVE = env_bool("HTTP_KEEP_ALIVE", True)
+HTTP_BACKEND = os.getenv("HTTP_BACKEND", "requests").strip().lower()  # requests | httpx（HTTP/2）
+HTTP_ACCEPT_ENCODING = os.getenv("HTTP_ACCEPT_ENCODING", "").strip()  # 空なら使えるデコーダから自動（gzip/br/zstd）
+
+# ---- Retry policy ----
+RETRY = env_int("RETRY", 3)                                 # 1 URL あたりの最大試行回数
+RETRY_BACKOFF_BASE = env_float("RETRY_BACKOFF_BASE", 1.0)   # 指数バックオフの初期値（秒）
+RETRY_BACKOFF_MAX = env_float("RETRY_BACKOFF_MAX", 30.0)    # バックオフ/Retry-After の上限（秒）
+RETRY_BUDGET = env_int("RETRY_BUDGET", 300)                 # 1 Run 全体で使えるリトライ回数
+
+# ---- HTTP cache (ETag / Last-Modified) ----
+HTTP_CACHE = env_bool("HTTP_CACHE", True)
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", ".cache/http")      # Actions cache で Run をまたいで復元
+HTTP_CACHE_MAX_AGE_DAYS = env_int("HTTP_CACHE_MAX_AGE_DAYS", 30)  # これより古い未使用エントリは削除
+
+# ---- Menu detail og:image ----
+MENU_IMG_STREAM = env_bool("MENU_IMG_STREAM", True)           # og:image が見えた時点で受信を打ち切る
+MENU_IMG_STREAM_MAX_BYTES = env_int("MENU_IMG_STREAM_MAX_BYTES", 256 * 1024)
+
+# ---- Circuit breaker ----
+BREAKER_FAILURES = env_int("BREAKER_FAILURES", 8)         # 連続失敗がこの回数に達したらオープン
+BREAKER_COOLDOWN = env_float("BREAKER_COOLDOWN", 60.0)    # オープン後、half-open で試すまでの待ち（秒）
+
+# ---- Sharding ----
+SHARD_COUNT = max(1, env_int("SHARD_COUNT", 1))   # 1 なら分割しない
+SHARD_INDEX = env_int("SHARD_INDEX", 0)           # 0 始まり
+
+# ---- Known-ID index ----
+ID_INDEX_ENABLED = env_bool("ID_INDEX", True)
+ID_INDEX_PATH = os.getenv("ID_INDEX_PATH", ".cache/id_index.json")   # Actions cache で Run をまたいで復元
+DEAD_RECHECK_DAYS = env_float("DEAD_RECHECK_DAYS", 1)                # dead になって最初の再チェックまで（日）。以後倍々
+DEAD_RECHECK_MAX_DAYS = env_float("DEAD_RECHECK_MAX_DAYS", 60)       # 再チェック間隔の上限（日）
+NEG_ERROR_TTL_HOURS = env_float("NEG_ERROR_TTL_HOURS", 6)            # 通信エラーで判定できなかった ID の再チェックまで
+PROBE_BUDGET = env_int("PROBE_BUDGET", 1000)                         # 1 Run で ID チェックする件数の上限（未知 + dead/error 再チェック。0 で無制限）
+
+# ---- Discovery source ----
+DISCOVERY_MODE = os.getenv("DISCOVERY", "probe").strip().lower()   # probe | sitemap | listing | frontier
+SITEMAP_URLS = [u for u in re.split(r"[\s,]+", os.getenv("SITEMAP_URLS", "")) if u]   # 空なら robots.txt から
+LISTING_URLS = [u for u in re.split(r"[\s,]+", os.getenv("LISTING_URLS", "")) if u]   # ランキング/エリア一覧ページ
+DISCOVERY_GAP_PROBE = env_bool("DISCOVERY_GAP_PROBE", True)   # sitemap/listing/frontier に無い欠番だけ ID チェック
+FRONTIER_SEEDS = [u for u in re.split(r"[\s,]+", os.getenv("FRONTIER_SEEDS", "")) if u] or LISTING_URLS   # 辿り始める一覧ページ
+FRONTIER_FOLLOW = os.getenv("FRONTIER_FOLLOW", "")              # ページ送り以外に辿る一覧リンクの正規表現（例: /ranking/）
+FRONTIER_MAX_DEPTH = env_int("FRONTIER_MAX_DEPTH", 50)          # seed から何リンク先まで辿るか
+FRONTIER_MAX_PAGES = env_int("FRONTIER_MAX_PAGES", 2000)        # 取得する一覧ページ数の上限
+
+# ---- Live ID ceiling (END_ID=auto) ----
+CEILING_MAX_ID = env_int("CEILING_MAX_ID", 9999)             # 探索の上限
+CEILING_GAP_TOLERANCE = env_int("CEILING_GAP_TOLERANCE", 30)  # これ未満の連続欠番は途切れとみなさない
+CEILING_LOOKAHEAD = max(1, env_int("CEILING_LOOKAHEAD", 4))   # 欠番の窓を先頭から何件ずつ同時に確認するか
+DETECTED_CEILING = os.getenv("DETECTED_CEILING", "").strip()   # 検出済みの上限（plan ジョブで1回だけ探し、各シャードに渡す）
+
+# ---- Fetch engine ----
+FETCH_WORKERS = env_int("FETCH_WORKERS", 4)             # ページ取得の同時実行数
+PROBE_WORKERS = env_int("PROBE_WORKERS", 8)             # ID 存在チェックの同時実行数
+PROBE_PROGRESS_EVERY = env_int("PROBE_PROGRESS_EVERY", 200)
+PROBE_METHOD = os.getenv("PROBE_METHOD", "head").strip().lower()   # head | get（get は本文を本取得で再利用）
+PROBE_BODY_MEMORY_MB = env_float("PROBE_BODY_MEMORY_MB", 64)        # 預かる本文のメモリ上限。超えたら一時ファイルへ
+DISCOVERY_QUEUE = env_int("DISCOVERY_QUEUE", 256)       # 探索→取得の先読みキュー長（0 で先読みしない）
+PARSE_WORKERS = env_int("PARSE_WORKERS", 0)              # パース専用プロセス数（0 ならページ取得スレッド内でパース）
+DOC_CACHE_MB = env_float("DOC_CACHE_MB", 32)            # パース済みクリニックページを持っておく上限（木のノード数で概算）
+REQUESTS_PER_SEC = env_float("REQUESTS_PER_SEC", 2.0)   # ホストごとのリクエストレート上限（ポライトネス）
+RATE_BURST = env_float("RATE_BURST", 2.0)               # 瞬間的に許容する連続リクエスト数
+
+# ---- HTML parser ----
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "auto").strip().lower()   # auto | lxml | html.parser（auto は lxml があれば lxml）
+PARSE_MODE = os.getenv("PARSE_MODE", "full").strip().lower()            # full | partial（抽出に使う領域だけ木にする）
+EXTRACT_ENGINE = os.getenv("EXTRACT_ENGINE", "bs4").strip().lower()     # bs4 | lexbor（selectolax。未導入なら bs4）
+
+# ---- Adaptive concurrency (AIMD) ----
+ADAPTIVE_CONCURRENCY = env_bool("ADAPTIVE_CONCURRENCY", True)  # false なら FETCH_WORKERS 固定
+ADAPTIVE_INITIAL = env_int("ADAPTIVE_INITIAL", 2)              # 開始時の同時リクエスト数
+ADAPTIVE_MIN = env_int("ADAPTIVE_MIN", 1)
+ADAPTIVE_WINDOW = env_int("ADAPTIVE_WINDOW", 20)               # 判定に使うサンプル数
+ADAPTIVE_LATENCY_TOLERANCE = env_float("ADAPTIVE_LATENCY_TOLERANCE", 1.5)  # p95 が基準の何倍までなら「横ばい」
+ADAPTIVE_SUCCESS_FLOOR = env_float("ADAPTIVE_SUCCESS_FLOOR", 0.95)        # 成功率がこれ未満なら増やさない
+ADAPTIVE_COOLDOWN = env_float("ADAPTIVE_COOLDOWN", 5.0)        # 連続で半減しないための間隔（秒）
 
 # ---- Utils ----
 def now_utc_iso():
@@ -28,6 +128,26 @@ def get_clinic_id_from_url(u: str):
     m = re.search(r"/clinics/(\d+)", u or "")
     return m.group(1) if m else ""
 
+def shard_bounds(n):
+    """0..n-1 を SHARD_COUNT 個の連続した区間に分けたときの自シャードの [lo, hi)"""
+    return n * SHARD_INDEX // SHARD_COUNT, n * (SHARD_INDEX + 1) // SHARD_COUNT
+
+def shard_slice(items):
+    lo, hi = shard_bounds(len(items))
+    return items[lo:hi]
+
+def shard_id_range(start_id, end_id):
+    lo, hi = shard_bounds(end_id - start_id + 1)
+    return start_id + lo, start_id + hi - 1
+
+def in_shard(cid):
+    """件数が事前にわからない探索（sitemap/listing）は ID の剰余で振り分ける"""
+    return int(cid) % SHARD_COUNT == SHARD_INDEX
+
+def url_in_shard(url):
+    """ID の無いページ（frontier の一覧ページ）は URL のハッシュで振り分ける"""
+    return zlib.crc32(url.encode("utf-8")) % SHARD_COUNT == SHARD_INDEX
+
 def load_urls_from_env():
     """
     TARGET_URLS から URL 群を抽出。
@@ -38,99 +158,1615 @@ def load_urls_from_env():
     found = re.findall(r"https?://.*?(?=https?://|\s|$)", flat)
     uniq, seen = [], set()
     for u in found:
-        u = u.strip()
-        if u and u not in seen:
-            uniq.append(u); seen.add(u)
+        key = canonical_url(u)   # 重複判定だけに使い、取得するのは書かれた URL
+        if key and key not in seen:
+            uniq.append(u.strip()); seen.add(key)
     return uniq
 
+# ---- HTTP session ----
+class PooledAdapter(HTTPAdapter):
+    """破棄されたプールのコネクション数も集計に残す HTTPAdapter"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.retired = {"num_connections": 0, "num_requests": 0}
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def on_dispose(pool):
+            self.retired["num_connections"] += pool.num_connections
+            self.retired["num_requests"] += pool.num_requests
+            if dispose:
+                dispose(pool)
+        pools.dispose_func = on_dispose
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+HTTP_STATS = {"requests": 0, "errors": 0}
+HTTP_VERSIONS = {}
+
+class TokenBucket:
+    """rate 件/秒で補充、最大 burst 件まで貯まるトークンバケット（スレッドセーフ）"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """1トークン取得。足りなければ前借りして補充されるまで待つ。待った秒数を返す。"""
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class RateLimiter:
+    """ホスト単位のトークンバケットを束ねる。全 HTTP 呼び出しがここから取得する。"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        wait = bucket.acquire()
+        if wait:
+            with self.lock:
+                self.waited += wait
+
+    def stats(self):
+        return {"rate_per_sec": self.rate, "burst": self.burst,
+                "hosts": sorted(self.buckets), "waited_sec": round(self.waited, 1)}
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SEC, RATE_BURST)
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """ブレーカーが開いているため送信しなかった"""
+
+class CircuitBreaker:
+    """
+    ホスト単位のサーキットブレーカー。
+    ・closed: 通常。連続失敗（例外/429/5xx）が threshold 回でオープン
+    ・open: cooldown 秒は即座に CircuitOpenError（送信しない）。スキップした URL を記録
+    ・half_open: cooldown 後に1件だけ試す。成功で closed、失敗で再びオープン。
+      試行中に断った URL は deferred にも残す（試行が済めば送れるので、再開パスがもう一度回す）
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.hosts = {}
+        self.skipped = []
+        self.deferred = set()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = {"state": "closed", "failures": 0, "opened_at": 0.0, "probing": False}
+        return self.hosts[host]
+
+    def before(self, url):
+        with self.lock:
+            h = self._host(url)
+            if h["state"] == "open" and time.monotonic() - h["opened_at"] >= self.cooldown:
+                h["state"] = "half_open"
+                h["probing"] = False
+            if h["state"] == "closed" or (h["state"] == "half_open" and not h["probing"]):
+                if h["state"] == "half_open":
+                    h["probing"] = True
+                    print(f"[Breaker] half-open probe {url}")
+                return
+            self.skipped.append(url)
+            if h["state"] == "half_open":
+                self.deferred.add(url)
+        page_skips = getattr(self.local, "skipped", None)
+        if page_skips is not None:
+            page_skips.append(url)
+        raise CircuitOpenError(f"circuit open for {urlsplit(url).netloc}")
+
+    def after(self, url, failed):
+        with self.lock:
+            h = self._host(url)
+            if not failed:
+                if h["state"] != "closed":
+                    print(f"[Breaker] closed {urlsplit(url).netloc}")
+                h.update(state="closed", failures=0, probing=False)
+                return
+            h["failures"] += 1
+            if h["state"] == "half_open" or (h["state"] == "closed" and h["failures"] >= self.threshold):
+                h.update(state="open", opened_at=time.monotonic(), probing=False)
+                self.opened += 1
+                print(f"[Breaker] open {urlsplit(url).netloc} after {h['failures']} failures; cooling {self.cooldown:.0f}s")
+
+    def begin_page(self):
+        self.local.skipped = []
+
+    def end_page(self):
+        skipped, self.local.skipped = getattr(self.local, "skipped", None) or [], None
+        return skipped
+
+    def retryable(self, urls):
+        """urls のうち half-open の試行中に断っただけのもの（試行が通って全ホスト closed のときだけ）"""
+        with self.lock:
+            if any(h["state"] != "closed" for h in self.hosts.values()):
+                return []
+            return [u for u in urls if u in self.deferred]
+
+    def wait_for_cooldown(self):
+        """オープン中のホストが half-open になるまで待つ。次の再開パスに備えて deferred は空にする"""
+        with self.lock:
+            waits = [self.cooldown - (time.monotonic() - h["opened_at"])
+                     for h in self.hosts.values() if h["state"] == "open"]
+            self.deferred.clear()
+        wait = max(waits, default=0.0)
+        if wait > 0:
+            print(f"[Breaker] cooling down {wait:.0f}s before resume pass")
+            time.sleep(wait)
+
+    def report(self):
+        return {"threshold": self.threshold, "cooldown_sec": self.cooldown, "opened": self.opened,
+                "skipped_requests": len(self.skipped),
+                "states": {host: h["state"] for host, h in self.hosts.items()}}
+
+BREAKER = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+
+class AdaptiveConcurrency:
+    """
+    同時リクエスト数を AIMD で調整するゲート。
+    ・window 件ごとに p95 レイテンシが基準の tolerance 倍以内かつ成功率が floor 以上なら +1
+    ・429/503/タイムアウトを観測したら半減（cooldown 秒に1回まで）
+    """
+    def __init__(self, initial, minimum, maximum, window, tolerance, floor, cooldown, enabled=True):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial)) if enabled else self.maximum
+        self.enabled = enabled
+        self.window = max(1, window)
+        self.tolerance = tolerance
+        self.floor = floor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.samples = []
+        self.baseline_p95 = None
+        self.last_cut = 0.0
+        self.started = time.monotonic()
+        self.history = [{"t": 0.0, "limit": self.limit, "reason": "start"}]
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, status=None, error=None):
+        with self.cond:
+            self.in_flight -= 1
+            if self.enabled:
+                self._observe(latency, status, error)
+            self.cond.notify_all()
+
+    def _set_limit(self, limit, reason):
+        if limit == self.limit:
+            return
+        print(f"[Concurrency] {self.limit} -> {limit} ({reason})")
+        self.limit = limit
+        self.history.append({"t": round(time.monotonic() - self.started, 1), "limit": limit, "reason": reason})
+
+    def _observe(self, latency, status, error):
+        congested = isinstance(error, requests.exceptions.Timeout) or status in (429, 503)
+        if congested:
+            now = time.monotonic()
+            if now - self.last_cut >= self.cooldown:
+                self.last_cut = now
+                self._set_limit(max(self.minimum, self.limit // 2), f"backoff status={status or type(error).__name__}")
+            self.samples.clear()
+            return
+        ok = error is None and status is not None and status < 500
+        self.samples.append((latency, ok))
+        if len(self.samples) < self.window:
+            return
+        lat = sorted(x for x, _ in self.samples)
+        p95 = lat[int(0.95 * (len(lat) - 1))]
+        success = sum(1 for _, o in self.samples if o) / len(self.samples)
+        self.samples.clear()
+        if self.baseline_p95 is None:
+            self.baseline_p95 = p95
+        if p95 <= self.baseline_p95 * self.tolerance and success >= self.floor:
+            self.baseline_p95 = 0.8 * self.baseline_p95 + 0.2 * p95
+            if self.limit < self.maximum:
+                self._set_limit(self.limit + 1, f"p95={p95:.2f}s success={success:.0%}")
+
+    def stats(self):
+        levels = [h["limit"] for h in self.history]
+        return {"enabled": self.enabled, "final": self.limit, "min_seen": min(levels),
+                "max_seen": max(levels), "history": self.history[-500:]}
+
+CONCURRENCY = AdaptiveConcurrency(
+    ADAPTIVE_INITIAL, ADAPTIVE_MIN, max(FETCH_WORKERS, PROBE_WORKERS), ADAPTIVE_WINDOW,
+    ADAPTIVE_LATENCY_TOLERANCE, ADAPTIVE_SUCCESS_FLOOR, ADAPTIVE_COOLDOWN,
+    enabled=ADAPTIVE_CONCURRENCY,
+)
+
+def get_session():
+    """全 HTTP 呼び出しで共有する keep-alive セッション（遅延生成）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = PooledAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    pool_block=HTTP_POOL_BLOCK,
+                )
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers["User-Agent"] = USER_AGENT
+                if not HTTP_KEEP_ALIVE:
+                    s.headers["Connection"] = "close"
+                _session = s
+    return _session
+
+def bump_stat(key, n=1, stats=HTTP_STATS):
+    with _stats_lock:
+        stats[key] = stats.get(key, 0) + n
+
+# ---- HTTP client backends ----
+class RequestsBackend:
+    """requests（HTTP/1.1, keep-alive プール）"""
+    name = "requests"
+
+    def request(self, method, url, timeout, **kwargs):
+        return get_session().request(method, url, timeout=timeout, **kwargs)
+
+    def http_version(self, response):
+        v = getattr(response.raw, "version", 11)
+        return {10: "HTTP/1.0", 11: "HTTP/1.1", 20: "HTTP/2"}.get(v, str(v))
+
+    def accept_encoding(self):
+        """urllib3 が展開できる形式（brotli / zstandard が入っていれば br / zstd も）"""
+        if HTTP_ACCEPT_ENCODING:
+            return HTTP_ACCEPT_ENCODING
+        try:
+            from urllib3.util.request import ACCEPT_ENCODING
+            return ACCEPT_ENCODING
+        except ImportError:
+            return "gzip,deflate"
+
+    def wire_bytes(self, response):
+        """圧縮されたまま受信したバイト数（本文を読み終えた後に呼ぶ）"""
+        try:
+            return response.raw.tell()
+        except Exception:
+            return 0
+
+class HttpxResponse:
+    """httpx.Response を requests.Response と同じ使い方で扱うための薄いラッパ"""
+    def __init__(self, resp):
+        self._resp = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.url = str(resp.url)
+        self.history = [HttpxResponse(h) for h in resp.history]
+        self.http_version = resp.http_version
+
+    @property
+    def content(self):
+        return self._resp.content
+
+    @property
+    def text(self):
+        return self._resp.text
+
+    @property
+    def encoding(self):
+        return self._resp.encoding
+
+    def iter_content(self, chunk_size=8192):
+        return self._resp.iter_bytes(chunk_size)
+
+    @property
+    def wire_bytes(self):
+        return self._resp.num_bytes_downloaded
+
+    def close(self):
+        self._resp.close()
+
+class HttpxBackend:
+    """
+    httpx + HTTP/2。同一ホストへの多数のリクエストを少数のコネクションに多重化する。
+    例外は requests の例外に読み替えるので、リトライ/ブレーカー側はそのまま使える。
+    """
+    name = "httpx"
+
+    def __init__(self, http1=True, http2=True):
+        import httpx
+        self.httpx = httpx
+        self.client = httpx.Client(
+            http1=http1, http2=http2,
+            limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE,
+                                max_keepalive_connections=HTTP_POOL_MAXSIZE if HTTP_KEEP_ALIVE else 0),
+            headers={"User-Agent": USER_AGENT},
+        )
+
+    def request(self, method, url, timeout, headers=None, allow_redirects=True, stream=False):
+        httpx = self.httpx
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        req = self.client.build_request(method, url, headers=headers,
+                                        timeout=httpx.Timeout(read, connect=connect))
+        try:
+            resp = self.client.send(req, stream=stream, follow_redirects=allow_redirects)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        return HttpxResponse(resp)
+
+    def http_version(self, response):
+        return response.http_version
+
+    def accept_encoding(self):
+        """httpx が展開できる形式（brotli / zstandard が入っていれば br / zstd も）"""
+        return HTTP_ACCEPT_ENCODING or self.client.headers.get("Accept-Encoding", "gzip, deflate")
+
+    def wire_bytes(self, response):
+        return response.wire_bytes
+
+def make_backend(name):
+    backend = None
+    if name in ("httpx", "http2"):
+        try:
+            backend = HttpxBackend()
+        except ImportError:
+            print("[HTTP] httpx[http2] is not installed; falling back to requests")
+    backend = backend or RequestsBackend()
+    print(f"[HTTP] backend={backend.name} Accept-Encoding: {backend.accept_encoding()}")
+    return backend
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _session_lock:
+            if _backend is None:
+                _backend = make_backend(HTTP_BACKEND)
+    return _backend
+
+def http_request(method, url, timeout, **kwargs):
+    """
+    すべての HTTP 呼び出しの入口。
+    ブレーカー・同時実行枠・レートを守ってセッション経由で送信し、件数とレイテンシを記録する。
+    """
+    BREAKER.before(url)
+    CONCURRENCY.acquire()
+    t0 = time.monotonic()
+    status = error = None
+    try:
+        RATE_LIMITER.acquire(url)
+        t0 = time.monotonic()
+        bump_stat("requests")
+        backend = get_backend()
+        headers = {"Accept-Encoding": backend.accept_encoding(), **(kwargs.pop("headers", None) or {})}
+        r = backend.request(method, url, timeout=timeout, headers=headers, **kwargs)
+        status = r.status_code
+        bump_stat(backend.http_version(r), stats=HTTP_VERSIONS)
+        if not kwargs.get("stream"):
+            record_transfer(url, r, len(r.content))
+        return r
+    except Exception as e:
+        error = e
+        bump_stat("errors")
+        raise
+    finally:
+        CONCURRENCY.release(time.monotonic() - t0, status, error)
+        BREAKER.after(url, error is not None or status == 429 or (status or 0) >= 500)
+
+TRANSFER_LOG = []   # URL ごとの転送量（output/transfer.csv）
+
+def record_transfer(url, response, body_bytes):
+    """受信バイト数（圧縮後=wire / 展開後=body）と Content-Encoding を記録"""
+    entry = {
+        "url": url,
+        "status": response.status_code,
+        "content_encoding": (response.headers.get("Content-Encoding") or "identity").lower(),
+        "wire_bytes": get_backend().wire_bytes(response),
+        "body_bytes": body_bytes,
+    }
+    with _stats_lock:
+        TRANSFER_LOG.append(entry)
+
+def transfer_summary():
+    """Run 全体と URL 種別（パス先頭: clinics / menus ...）ごとの転送量"""
+    def new():
+        return {"requests": 0, "wire_bytes": 0, "body_bytes": 0, "encodings": {}}
+
+    total, sections = new(), {}
+    with _stats_lock:
+        entries = list(TRANSFER_LOG)
+    for e in entries:
+        section = (urlsplit(e["url"]).path.strip("/").split("/") or [""])[0] or "/"
+        for agg in (total, sections.setdefault(section, new())):
+            agg["requests"] += 1
+            agg["wire_bytes"] += e["wire_bytes"]
+            agg["body_bytes"] += e["body_bytes"]
+            agg["encodings"][e["content_encoding"]] = agg["encodings"].get(e["content_encoding"], 0) + 1
+    for agg in [total, *sections.values()]:
+        agg["compression_ratio"] = round(agg["wire_bytes"] / agg["body_bytes"], 4) if agg["body_bytes"] else None
+    total["accept_encoding"] = get_backend().accept_encoding()
+    total["sections"] = sections
+    return total
+
+def http_pool_stats():
+    """コネクション再利用率（新規接続数 / プール経由リクエスト数）を集計（requests バックエンドのみ）"""
+    new_conns = pooled = 0
+    adapters = [] if _session is None else {id(a): a for a in _session.adapters.values()}.values()
+    for adapter in adapters:
+        retired = getattr(adapter, "retired", {})
+        new_conns += retired.get("num_connections", 0)
+        pooled += retired.get("num_requests", 0)
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                new_conns += pool.num_connections
+                pooled += pool.num_requests
+    reuse = (1 - new_conns / pooled) if pooled else 0.0
+    return {
+        "backend": get_backend().name,
+        "http_versions": dict(HTTP_VERSIONS),
+        "requests": HTTP_STATS["requests"],
+        "errors": HTTP_STATS["errors"],
+        "new_connections": new_conns,
+        "pooled_requests": pooled,
+        "reuse_rate": round(reuse, 4),
+        "pool_maxsize": HTTP_POOL_MAXSIZE,
+        "keep_alive": HTTP_KEEP_ALIVE,
+    }
+
+# ---- Retry policy ----
+class RetryPolicy:
+    """
+    ステータス/例外ごとのリトライ判定と待ち時間を決める。
+    ・404/410 など恒久的なエラーは即あきらめる
+    ・429/5xx/タイムアウト/接続エラーは指数バックオフ（ジッター付き）で再試行
+    ・Retry-After があればそれに従う（backoff_max まで）
+    ・Run 全体のリトライ回数は budget で打ち止め
+    """
+    RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+    RETRY_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+    def __init__(self, max_attempts, backoff_base, backoff_max, budget):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.stats = {"retries": 0, "gave_up_permanent": 0, "gave_up_exhausted": 0, "budget_denied": 0}
+
+    def should_retry(self, status=None, error=None):
+        if error is not None:
+            return isinstance(error, self.RETRY_ERRORS)
+        return status in self.RETRY_STATUSES
+
+    def take_budget(self):
+        with self.lock:
+            if self.budget <= 0:
+                self.stats["budget_denied"] += 1
+                return False
+            self.budget -= 1
+            self.stats["retries"] += 1
+            return True
+
+    def retry_after(self, response):
+        value = (response.headers.get("Retry-After") or "").strip() if response is not None else ""
+        if not value:
+            return None
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, response=None):
+        """attempt 回目の失敗後に待つ秒数"""
+        hinted = self.retry_after(response)
+        if hinted is not None:
+            return min(self.backoff_max, hinted)
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def record(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def report(self):
+        return dict(self.stats, budget_left=self.budget)
+
+RETRY_POLICY = RetryPolicy(RETRY, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX, RETRY_BUDGET)
+
+# ---- HTTP cache ----
+class HttpCache:
+    """
+    URL ごとに本文と検証子（ETag / Last-Modified）をディスクに保存し、
+    次回は条件付き GET で再検証する。304 ならキャッシュ本文をそのまま返す。
+    """
+    def __init__(self, root, enabled=True):
+        self.root = root
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "revalidated_changed": 0, "stored": 0, "pruned": 0}
+        self.lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.root, key[:2], key)
+        return base + ".json", base + ".html"
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def has(self, url):
+        return self.enabled and all(os.path.exists(p) for p in self._paths(url))
+
+    def lookup(self, url):
+        """保存済みのメタ情報（検証子）を返す。無ければ None。"""
+        if not self.enabled:
+            return None
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+        if not os.path.exists(body_path):
+            self._count("misses")
+            return None
+        return meta
+
+    def conditional_headers(self, meta):
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def _write(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def hit(self, url, meta):
+        """304 を受けたときにキャッシュ本文を返す（読めなければ None）"""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(body_path, encoding="utf-8") as f:
+                body = f.read()
+        except OSError:
+            return None
+        self._count("hits")
+        meta["checked"] = time.time()
+        self._write(meta_path, json.dumps(meta, ensure_ascii=False))
+        return body
+
+    def store(self, url, response, had_entry=False):
+        if had_entry:
+            self._count("revalidated_changed")
+        if not self.enabled:
+            return
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+        meta_path, body_path = self._paths(url)
+        self._write(body_path, response.text)
+        self._write(meta_path, json.dumps({
+            "url": url, "etag": etag, "last_modified": last_modified, "checked": time.time(),
+        }, ensure_ascii=False))
+        self._count("stored")
+
+    def prune(self, max_age_days):
+        """max_age_days 以上再検証されていないエントリを削除"""
+        if not (self.enabled and max_age_days > 0 and os.path.isdir(self.root)):
+            return
+        cutoff = time.time() - max_age_days * 86400
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(dirpath, name)
+                try:
+                    with open(meta_path, encoding="utf-8") as f:
+                        checked = json.load(f).get("checked", 0)
+                except (OSError, ValueError):
+                    checked = 0
+                if checked < cutoff:
+                    for path in (meta_path, meta_path[:-5] + ".html"):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    self._count("pruned")
+
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["revalidated_changed"]
+        return dict(self.stats, enabled=self.enabled, dir=self.root,
+                    hit_rate=round(self.stats["hits"] / lookups, 4) if lookups else 0.0)
+
+RESPONSE_CACHE = HttpCache(HTTP_CACHE_DIR, enabled=HTTP_CACHE)
+
 # ---- HTTP (safe) ----
-def fetch_safe(url, connect_timeout=5, read_timeout=TIMEOUT, retries=RETRY):
+FETCH_GONE = set()   # 404/410 で終わった URL（ID 索引の更新に使う）
+REDIRECTS = {}       # リダイレクトされた URL → 最終 URL（正規化済み）
+
+def note_redirect(url, r):
+    """リダイレクトされていれば最終 URL を覚える（304 でも r.history は残るので毎 Run 記録される）"""
+    if r.history:
+        final = canonical_url(str(r.url))
+        if final != canonical_url(url):
+            REDIRECTS[url] = final
+
+def moved_to_other_clinic(url, final_url):
+    """/clinics/NNNN が別の ID のクリニックへ転送されたか（その ID 自体は live ではない）"""
+    cid, final_id = get_clinic_id_from_url(url), get_clinic_id_from_url(final_url or "")
+    return bool(cid) and bool(final_url) and int(cid) != int(final_id or 0)
+
+def fetch_safe(url, connect_timeout=5, read_timeout=TIMEOUT, retries=None, policy=RETRY_POLICY):
     """
     ・接続/読み込みの両方にタイムアウトを設定
-    ・retries 回失敗したら "" を返して確実に復帰
+    ・policy に従って再試行（404 などは即終了）
+    ・キャッシュがあれば条件付き GET、304 ならキャッシュ本文を返す
+    ・最終的に失敗したら "" を返して確実に復帰
     """
-    last_exc = None
-    for i in range(retries):
+    cached = RESPONSE_CACHE.lookup(url)
+    attempts = retries or policy.max_attempts
+    for i in range(attempts):
+        r = err = None
         try:
-            r = requests.get(
-                url,
-                headers={"User-Agent": USER_AGENT},
+            r = http_request(
+                "GET", url,
+                headers=RESPONSE_CACHE.conditional_headers(cached),
                 timeout=(connect_timeout, read_timeout)  # (connect, read)
             )
+            if r.status_code == 304 and cached:
+                body = RESPONSE_CACHE.hit(url, cached)
+                if body is not None:
+                    note_redirect(url, r)
+                    return body
+                cached = None  # 本文が消えていたら通常の GET でやり直す
+                continue
             if r.status_code == 200:
+                RESPONSE_CACHE.store(url, r, had_entry=bool(cached))
+                note_redirect(url, r)
                 return r.text
-            else:
-                print(f"[fetch_safe {i+1}] bad status {r.status_code} {url}")
+            print(f"[fetch_safe {i+1}] bad status {r.status_code} {url}")
         except Exception as e:
-            last_exc = e
+            err = e
             print(f"[fetch_safe {i+1}] error {url}: {e}")
-        time.sleep(1)
+
+        if isinstance(err, CircuitOpenError):
+            break
+        status = r.status_code if r is not None else None
+        if status in (404, 410):
+            FETCH_GONE.add(url)
+        if not policy.should_retry(status, err):
+            policy.record("gave_up_permanent")
+            break
+        if i + 1 >= attempts:
+            policy.record("gave_up_exhausted")
+            break
+        if not policy.take_budget():
+            print(f"[fetch_safe] retry budget exhausted, giving up {url}")
+            break
+        wait = policy.delay(i + 1, r)
+        print(f"[fetch_safe {i+1}] retry in {wait:.1f}s {url}")
+        time.sleep(wait)
     print(f"[fetch_safe abort] {url}")
     return ""
 
-def check_url_exists(url):
+class BodyStore:
+    """
+    探索時の GET で得た本文を、本取得（scrape_page）まで預かる。
+    メモリ上限（文字数ベースの概算）を超えた分は一時ディレクトリへ退避し、take で取り出したら消す。
+    """
+    def __init__(self, max_memory_bytes):
+        self.max_memory = max_memory_bytes
+        self.mem = {}
+        self.mem_bytes = 0
+        self.disk = {}
+        self.spill_dir = None
+        self.lock = threading.Lock()
+        self.stats = {"stored_memory": 0, "spilled": 0, "reused": 0, "peak_memory_bytes": 0}
+
+    def put(self, url, text):
+        size = len(text)
+        with self.lock:
+            self.discard_locked(url)
+            if self.mem_bytes + size <= self.max_memory:
+                self.mem[url] = text
+                self.mem_bytes += size
+                self.stats["stored_memory"] += 1
+                self.stats["peak_memory_bytes"] = max(self.stats["peak_memory_bytes"], self.mem_bytes)
+                return
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="probe-bodies-")
+            path = os.path.join(self.spill_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+            self.disk[url] = path
+            self.stats["spilled"] += 1
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def discard_locked(self, url):
+        text = self.mem.pop(url, None)
+        if text is not None:
+            self.mem_bytes -= len(text)
+        path = self.disk.pop(url, None)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def take(self, url):
+        """預かっている本文を取り出す（1回限り）。無ければ None。"""
+        with self.lock:
+            text = self.mem.pop(url, None)
+            if text is not None:
+                self.mem_bytes -= len(text)
+            path = self.disk.pop(url, None) if text is None else None
+            if text is not None or path:
+                self.stats["reused"] += 1
+        if path:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.remove(path)
+        return text
+
+    def clear(self):
+        with self.lock:
+            self.mem.clear()
+            self.mem_bytes = 0
+            self.disk.clear()
+            if self.spill_dir:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+                self.spill_dir = None
+
+    def report(self):
+        return dict(self.stats, method=PROBE_METHOD, left_unused=len(self.mem) + len(self.disk))
+
+PROBE_BODIES = BodyStore(int(PROBE_BODY_MEMORY_MB * 1024 * 1024))
+
+PROBE_SKIPPED = set()   # ブレーカーで送らなかった存在チェック（main の再開パスで取り直す）
+
+def probe_error(url, e, method):
+    """通信エラーは None。ブレーカーで送らなかったものは PROBE_SKIPPED に残す"""
+    print(f"[check_url_exists {method} err] {url}: {e}")
+    if isinstance(e, CircuitOpenError):
+        with _stats_lock:
+            PROBE_SKIPPED.add(url)
+    return None
+
+def probe_status_get(url):
+    """GET で存在チェックし、200 の本文は PROBE_BODIES に預ける（キャッシュがあれば条件付き GET）"""
+    cached = RESPONSE_CACHE.lookup(url)
+    try:
+        r = http_request("GET", url, headers=RESPONSE_CACHE.conditional_headers(cached), timeout=(3, TIMEOUT))
+    except Exception as e:
+        return probe_error(url, e, "GET")
+    if r.status_code == 304 and cached:
+        body = RESPONSE_CACHE.hit(url, cached)
+        if body is None:
+            return None
+    elif r.status_code == 200:
+        RESPONSE_CACHE.store(url, r, had_entry=bool(cached))
+        body = r.text
+    else:
+        return r.status_code
+    note_redirect(url, r)
+    if moved_to_other_clinic(url, str(r.url)):
+        return r.history[0].status_code
+    PROBE_BODIES.put(url, body)
+    return 200
+
+def probe_status(url):
     """
     HEAD で軽く存在チェック → 405/403 の場合だけ GET を短時間で実施。
     どちらもタイムアウト付きで固まらないようにする。
+    ステータスコードを返し、通信エラー時は None。
+    PROBE_METHOD=get なら 1 回の GET で済ませ、本文を本取得で再利用する。
     """
+    if PROBE_METHOD == "get":
+        return probe_status_get(url)
     try:
-        r = requests.head(
-            url,
-            headers={"User-Agent": USER_AGENT},
+        r = http_request(
+            "HEAD", url,
             timeout=(3, 5),
             allow_redirects=True
         )
         if r.status_code in (405, 403):
             try:
-                r2 = requests.get(
-                    url,
-                    headers={"User-Agent": USER_AGENT},
+                r = http_request(
+                    "GET", url,
                     timeout=(3, 7)
                 )
-                return r2.status_code == 200
             except Exception as e:
-                print(f"[check_url_exists GET err] {url}: {e}")
-                return False
-        return r.status_code == 200
+                return probe_error(url, e, "GET")
+        # 別 ID への転送は、転送元の ID としては存在しない扱い（3xx を返す）
+        if r.history and moved_to_other_clinic(url, str(r.url)):
+            return r.history[0].status_code
+        return r.status_code
     except Exception as e:
-        print(f"[check_url_exists HEAD err] {url}: {e}")
-        return False
+        return probe_error(url, e, "HEAD")
 
-# ---- URL discovery (START_ID〜END_ID) ----
-def build_target_urls_auto():
+def check_url_exists(url):
+    return probe_status(url) == 200
+
+def is_definitive_status(status):
+    """ページの有無を判断できるステータスか（通信エラー/429/5xx は判断保留）"""
+    return status is not None and status != 429 and status < 500
+
+# ---- Known-ID index ----
+class IdIndex:
     """
-    START_ID〜END_ID の ID で
-    https://kireireport.com/clinics/0001
-    を順に存在チェック。
+    /clinics/NNNN の生死を Run をまたいで覚えておく索引（兼ネガティブキャッシュ）。
+    JSON に ID 昇順の配列を状態別に保存する:
+      live:  [id, checked_epoch]
+      dead:  [id, checked_epoch, fails]   404/410 など。fails 回連続で dead
+      error: [id, checked_epoch, fails]   通信エラー/429/5xx で判定できなかった
+    dead / error は TTL が切れるまで再チェックしない。TTL は fails に応じて倍々に延びる
+    （最近消えた ID ほど早く、長く消えている ID ほど間隔をあけて確認）。
     """
-    end_id_str = os.getenv("END_ID", "9999")
-    start_id_str = os.getenv("START_ID", "1")
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.entries = {}   # id -> (state, checked, fails)。無効時も Run 内のメモとして使う
+        self.lock = threading.Lock()
+        if enabled and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                for cid, checked, *_ in data.get("live", []):
+                    self.entries[int(cid)] = ("live", checked, 0)
+                for state in ("dead", "error"):
+                    for cid, checked, *rest in data.get(state, []):
+                        self.entries[int(cid)] = (state, checked, rest[0] if rest else 1)
+            except (OSError, ValueError) as e:
+                print(f"[IdIndex] ignore broken index {path}: {e}")
+
+    def mark(self, cid, alive, checked=None):
+        self._mark(int(cid), "live" if alive else "dead", checked)
+
+    def mark_error(self, cid, checked=None):
+        self._mark(int(cid), "error", checked)
+
+    def _mark(self, cid, state, checked):
+        with self.lock:
+            prev = self.entries.get(cid)
+            fails = 0 if state == "live" else (prev[2] + 1 if prev and prev[0] == state else 1)
+            self.entries[cid] = (state, checked or time.time(), fails)
+
+    @property
+    def max_live(self):
+        return max((cid for cid, (state, _, _) in self.entries.items() if state == "live"), default=0)
+
+    def due_at(self, cid):
+        """dead / error の次回チェック時刻。ID ごとに ±20% ずらして同じ夜に集中させない。"""
+        state, checked, fails = self.entries[cid]
+        if state == "error":
+            ttl = NEG_ERROR_TTL_HOURS * 3600
+        else:
+            ttl = min(DEAD_RECHECK_DAYS * 2 ** max(0, fails - 1), DEAD_RECHECK_MAX_DAYS) * 86400
+        stagger = 0.8 + 0.4 * ((cid * 2654435761) % 1000) / 1000
+        return checked + ttl * stagger
+
+    def known_state(self, cid, now=None):
+        """TTL 内なら True(live) / False(dead)。未知・期限切れ・error は None（要チェック）"""
+        entry = self.entries.get(cid)
+        if entry is None or entry[0] == "error":
+            return None
+        if entry[0] == "live":
+            return True
+        return False if self.due_at(cid) > (now or time.time()) else None
+
+    def plan(self, start_id, end_id, budget, exclude=frozenset(), now=None):
+        """
+        範囲内の ID を振り分ける。
+        戻り値: (既知の live, 要チェック, スキップ数, 予算超過で見送った再チェック数, 同 未知 ID の一覧)
+        ・live → チェックせずに取得対象へ（取得で 404 なら dead に更新）
+        ・dead / error → TTL 切れのものを期限超過が大きい順に再チェック
+        ・未知（既知の最大 ID より上を含む）→ ID の小さい順にチェック
+        チェックは未知と再チェックを合わせて budget 件まで（END_ID をいくら大きくしても1 Run の量は増えない）。
+        予算は半分ずつ分け、片方が余ればもう片方に回す。見送った ID は状態が変わらないので次の Run で拾う。
+        budget が None なら予算はかけない（索引を保存しない ID_INDEX=false のときは持ち越せないので None）。
+        """
+        now = now or time.time()
+        live, unknown, due, skipped = [], [], [], 0
+        for cid in range(start_id, end_id + 1):
+            if cid in exclude:
+                continue
+            entry = self.entries.get(cid)
+            if entry is None:
+                unknown.append(cid)
+            elif entry[0] == "live":
+                live.append(cid)
+            elif self.due_at(cid) <= now:
+                due.append((self.due_at(cid), cid))
+            else:
+                skipped += 1
+        due.sort()
+        n_recheck, n_unknown = len(due), len(unknown)
+        if self.enabled and budget is not None:
+            n_recheck = min(len(due), max(budget // 2, budget - len(unknown)))
+            n_unknown = min(len(unknown), budget - n_recheck)
+        recheck = [cid for _, cid in due[:n_recheck]]
+        deferred = len(due) - n_recheck
+        return live, sorted(unknown[:n_unknown] + recheck), skipped + deferred, deferred, unknown[n_unknown:]
+
+    def update(self, other):
+        """別の索引（各シャードの保存分）を取り込む。同じ ID は確認が新しい方を残す"""
+        with self.lock:
+            for cid, entry in other.entries.items():
+                prev = self.entries.get(cid)
+                if prev is None or entry[1] > prev[1]:
+                    self.entries[cid] = entry
+
+    def save(self, path=None):
+        if not self.enabled:
+            return
+        path = path or self.path
+        with self.lock:
+            items = sorted(self.entries.items())
+        data = {
+            "version": 2,
+            "max_live": self.max_live,
+            "live": [[cid, round(checked)] for cid, (state, checked, _) in items if state == "live"],
+            "dead": [[cid, round(checked), fails] for cid, (state, checked, fails) in items if state == "dead"],
+            "error": [[cid, round(checked), fails] for cid, (state, checked, fails) in items if state == "error"],
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        print(f"[IdIndex] saved {path} live={len(data['live'])} dead={len(data['dead'])} error={len(data['error'])}")
+
+ID_INDEX = IdIndex(ID_INDEX_PATH, enabled=ID_INDEX_ENABLED)
 
-    if not end_id_str.isdigit() or not start_id_str.isdigit():
-        raise SystemExit("START_ID / END_ID must be numeric")
+# ---- URL discovery (START_ID〜END_ID) ----
+CLINICS_BASE_URL = os.getenv("CLINICS_BASE_URL", "https://kireireport.com/clinics").rstrip("/")
+DISCOVERY_STATS = {}
+
+def clinic_url_for_id(cid):
+    return f"{CLINICS_BASE_URL}/{cid:04d}"
+
+def record_probe(cid, status):
+    if is_definitive_status(status):
+        ID_INDEX.mark(cid, status == 200)
+    elif clinic_url_for_id(int(cid)) not in PROBE_SKIPPED:   # 送っていないものは何も分かっていない
+        ID_INDEX.mark_error(cid)
+
+def is_live_id(cid):
+    """索引が新しければそれを使い、無ければ存在チェックして索引も更新"""
+    known = ID_INDEX.known_state(cid)
+    if known is not None:
+        return known
+    status = probe_status(clinic_url_for_id(cid))
+    record_probe(cid, status)
+    bump_stat("ceiling_probes", stats=DISCOVERY_STATS)
+    return status == 200
+
+class ProbeBudgetExhausted(Exception):
+    """上限探索の途中で PROBE_BUDGET を使い切った"""
+
+def probe_budget_left():
+    """この Run で残っている ID チェックの件数（上限探索の分を差し引く）。予算をかけないときは None"""
+    if not (ID_INDEX.enabled and PROBE_BUDGET > 0):
+        return None
+    return max(PROBE_BUDGET - DISCOVERY_STATS.get("ceiling_probes", 0), 0)
+
+def first_live_in_window(cid, tolerance, max_id):
+    """
+    cid〜cid+tolerance-1 の中で最初に live な ID（無ければ None）。欠番の吸収用。
+    先頭から CEILING_LOOKAHEAD 件ずつ確認し、live が見つかればその先は確認しない。
+    予算が尽きて窓を確かめ切れないときは ProbeBudgetExhausted。
+    """
+    window = range(cid, min(cid + tolerance, max_id + 1))
+    for i in range(0, len(window), CEILING_LOOKAHEAD):
+        chunk = list(window[i:i + CEILING_LOOKAHEAD])
+        left, cut = probe_budget_left(), False
+        if left is not None:
+            need = [c for c in chunk if ID_INDEX.known_state(c) is None]
+            if len(need) > left:   # 索引で分かる ID は予算を使わない
+                chunk, cut = chunk[:chunk.index(need[left])], True
+        for found, alive in run_ordered(is_live_id, chunk, workers=len(chunk)):
+            if alive:
+                return found
+        if cut:
+            raise ProbeBudgetExhausted
+    return None
+
+def detect_live_ceiling(start_id, max_id, tolerance):
+    """
+    生きている最大の clinic ID を探す。
+    1) 既知の最大 live ID（なければ start_id）から 1, 2, 4, 8... と倍々に先を確認（galloping）
+    2) 初めて「tolerance 件連続で dead」の窓に当たったら、そこまでを二分探索
+    欠番が tolerance 未満なら途切れとはみなさない。
+    確認した ID は PROBE_BUDGET に数える。途中で尽きたらそこまでで確かめた live を上限とし、
+    索引に残った結果から次の Run が続きを探す。
+    """
+    t0 = time.monotonic()
+    lo = max(start_id, min(ID_INDEX.max_live, max_id))
+    hi = max_id + 1
+    try:
+        if not is_live_id(lo):
+            lo = first_live_in_window(lo, tolerance, max_id) or start_id
+        step = 1
+        while lo + step <= max_id:
+            found = first_live_in_window(lo + step, tolerance, max_id)
+            if found is None:
+                hi = lo + step
+                break
+            lo = found
+            step *= 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            found = first_live_in_window(mid, tolerance, max_id)
+            if found is None:
+                hi = mid
+            else:
+                lo = found
+    except ProbeBudgetExhausted:
+        DISCOVERY_STATS.update(ceiling_budget_exhausted=True)
+        print(f"[ceiling warn] PROBE_BUDGET={PROBE_BUDGET} used up by the ceiling search; "
+              f"stopping at {lo:04d} (later runs continue from the ID index)")
+    DISCOVERY_STATS.update(detected_ceiling=lo, ceiling_search_sec=round(time.monotonic() - t0, 1))
+    print(f"[ceiling] highest live clinic ID ≈ {lo:04d} (gap tolerance {tolerance}, "
+          f"{DISCOVERY_STATS.get('ceiling_probes', 0)} probes)")
+    return lo
+
+def resolve_id_range():
+    """START_ID / END_ID（END_ID=auto なら最大 live ID を検出）"""
+    end_id_str = (os.getenv("END_ID", "9999") or "9999").strip().lower()
+    start_id_str = (os.getenv("START_ID", "1") or "1").strip()
+
+    if not (end_id_str.isdigit() or end_id_str == "auto") or not start_id_str.isdigit():
+        raise SystemExit("START_ID must be numeric, END_ID numeric or 'auto'")
 
     start_id = int(start_id_str)
-    end_id = int(end_id_str)
     if start_id < 1:
         start_id = 1
+    if end_id_str == "auto" and DETECTED_CEILING.isdigit():
+        end_id = int(DETECTED_CEILING)
+        DISCOVERY_STATS.update(detected_ceiling=end_id)
+        print(f"[ceiling] using detected ceiling {end_id:04d}")
+    elif end_id_str == "auto":
+        end_id = detect_live_ceiling(start_id, CEILING_MAX_ID, CEILING_GAP_TOLERANCE)
+    else:
+        end_id = int(end_id_str)
     if end_id < start_id:
         raise SystemExit(f"END_ID({end_id}) must be >= START_ID({start_id})")
+    return start_id, end_id
 
-    base_url = "https://kireireport.com/clinics"
-    valid_urls = []
-
-    print(f"[build_target_urls_auto] scan {start_id:04d}〜{end_id:04d}")
-    for cid in range(start_id, end_id + 1):
-        url = f"{base_url}/{cid:04d}"
-        if check_url_exists(url):
-            valid_urls.append(url)
-            print(f"[OK] {url}")
+def build_target_urls_auto(id_range=None, exclude=frozenset()):
+    """
+    START_ID〜END_ID の ID で
+    https://kireireport.com/clinics/0001
+    を存在チェック。既知の ID 索引で live は確認を省略し、TTL 内の dead/error は飛ばす。
+    exclude の ID（別の探索元で見つかったもの）は対象外。
+    全件の確認を待たず、既知の live を先に、続いて確認できた live を ID 順に返す（取得と並行して進む）。
+    """
+    if id_range is None:
+        start_id, end_id = resolve_id_range()
+        if SHARD_COUNT > 1 and "detected_ceiling" in DISCOVERY_STATS and not DETECTED_CEILING:
+            # シャードごとに検出した上限は食い違いうるので、連続区間ではなく剰余で分ける
+            exclude = exclude | {cid for cid in range(start_id, end_id + 1) if not in_shard(cid)}
         else:
-            print(f"[NG] {url}")
-        time.sleep(0.05)
-    return valid_urls
+            start_id, end_id = shard_id_range(start_id, end_id)
+    else:
+        start_id, end_id = id_range
+    if end_id < start_id:
+        return
+    budget = probe_budget_left()   # 上限探索で使った分は差し引く
+    known_live, to_probe, skipped_dead, deferred, unknown_deferred = ID_INDEX.plan(start_id, end_id, budget, exclude)
+    live_ids = set(known_live)
+    total = len(to_probe)
+
+    def probe(cid):
+        url = clinic_url_for_id(cid)
+        return url, probe_status(url)
+
+    print(f"[build_target_urls_auto] scan {start_id:04d}〜{end_id:04d} workers={PROBE_WORKERS} "
+          f"known_live={len(known_live)} skip_dead={skipped_dead} probe={total} "
+          f"(budget deferred: recheck {deferred}, unknown {len(unknown_deferred)})")
+    if unknown_deferred:
+        print(f"[probe warn] PROBE_BUDGET={PROBE_BUDGET}: {len(unknown_deferred)} unchecked IDs from "
+              f"{unknown_deferred[0]:04d} are left for later runs (this run covers new IDs only below that)")
+    t0 = time.monotonic()
+    done = 0
+
+    def probed():
+        nonlocal done
+        for cid, (url, status) in run_ordered(probe, to_probe, workers=PROBE_WORKERS):
+            done += 1
+            if status == 200:
+                live_ids.add(cid)
+                print(f"[OK] {url}")
+            else:
+                print(f"[NG] {url}")
+            record_probe(cid, status)
+            if done % PROBE_PROGRESS_EVERY == 0 or done == total:
+                rate = done / max(time.monotonic() - t0, 1e-6)
+                print(f"[probe] {done}/{total} live={len(live_ids)} {rate:.1f} probes/s")
+            if status == 200:
+                yield cid
+
+    # 既知 live はすぐ流し、その間も裏で ID チェックを進めて確認できたものから続けて流す
+    confirmed = prefetch(probed(), maxsize=max(1, DISCOVERY_QUEUE))
+    for cid in known_live:
+        yield clinic_url_for_id(cid)
+    for cid in confirmed:
+        yield clinic_url_for_id(cid)
+
+    elapsed = time.monotonic() - t0
+    DISCOVERY_STATS.update(
+        known_live=len(known_live), skipped_dead=skipped_dead, recheck_deferred=deferred,
+        unknown_deferred=len(unknown_deferred),
+        probed=done, live=len(live_ids), elapsed_sec=round(elapsed, 1),
+        probes_per_sec=round(done / elapsed, 2) if elapsed else None,
+    )
+
+# ---- URL discovery (sitemap / listing pages) ----
+LOC_RE = re.compile(r"<loc>\s*(.*?)\s*</loc>", re.I | re.S)
+CLINIC_PATH_RE = re.compile(r"/clinics/\d+/?$")
+
+def site_root():
+    parts = urlsplit(CLINICS_BASE_URL)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def sitemap_urls_from_robots():
+    """robots.txt の Sitemap: 行。無ければ /sitemap.xml"""
+    robots = fetch_safe(site_root() + "/robots.txt")
+    found = re.findall(r"(?im)^\s*sitemap:\s*(\S+)", robots or "")
+    return found or [site_root() + "/sitemap.xml"]
+
+def iter_sitemap_clinic_urls(sitemap_urls, max_sitemaps=200):
+    """sitemap（index は再帰）から /clinics/NNNN の URL を見つけた順に返す"""
+    queue, seen = deque(sitemap_urls), set()
+    while queue and len(seen) < max_sitemaps:
+        sm = queue.popleft()
+        if sm in seen:
+            continue
+        seen.add(sm)
+        xml = fetch_safe(sm)
+        if not xml:
+            continue
+        locs = [unescape(x) for x in LOC_RE.findall(xml)]
+        bump_stat("sitemaps", stats=DISCOVERY_STATS)
+        if re.search(r"<sitemapindex\b", xml, re.I):
+            queue.extend(locs)
+            continue
+        for loc in locs:
+            if CLINIC_PATH_RE.search(urlsplit(loc).path):
+                yield loc
+
+def listing_clinic_links(soup, page_url):
+    """ランキング/エリア一覧（.card.clinic-list__card）のカードにあるクリニック URL"""
+    return [urljoin(page_url, a["href"]) for a in soup.select(".card.clinic-list__card a.card__title[href]")]
+
+def iter_listing_clinic_urls(listing_urls):
+    """指定された一覧ページだけを見てクリニック URL を返す"""
+    for page_url in listing_urls:
+        html = fetch_safe(page_url)
+        if not html:
+            continue
+        bump_stat("listing_pages", stats=DISCOVERY_STATS)
+        yield from listing_clinic_links(make_soup(html), page_url)
+
+PAGINATION_SELECTOR = "a[rel~=next][href], .pagination a[href]"
+
+def frontier_links(soup, page_url):
+    """次に辿る一覧ページを (優先度, URL) で返す。ページ送り=0、FRONTIER_FOLLOW に合うリンク=1"""
+    host = urlsplit(page_url).netloc
+    links = [(0, a["href"]) for a in soup.select(PAGINATION_SELECTOR)]
+    if FRONTIER_FOLLOW:
+        follow = re.compile(FRONTIER_FOLLOW)
+        links += [(1, a["href"]) for a in soup.select("a[href]") if follow.search(a["href"])]
+    for prio, href in links:
+        url = urljoin(page_url, href).split("#", 1)[0]
+        parts = urlsplit(url)
+        if parts.netloc == host and not CLINIC_PATH_RE.search(parts.path):
+            yield prio, url
+
+def iter_frontier_urls(seeds, max_depth=FRONTIER_MAX_DEPTH, max_pages=FRONTIER_MAX_PAGES):
+    """
+    一覧ページを辿るクローラ。取得した一覧ページの URL と、そのカードにあるクリニック URL を返す。
+    一覧ページはここでパースした木を DOCS に預けるので、取得側は取り直しもパースし直しもせずに
+    カードの行（順位・評価など）を作れる。
+    同じ深さの一覧ページはまとめて並列取得し（幅優先）、見つけ次第返す。
+    ページ送りと FRONTIER_FOLLOW のリンクは訪問済みを除いて次の深さに積む（ページ送りを優先）。
+    """
+    # 訪問済みは正規化 URL で見る。取得するのはリンクに書かれた URL
+    level, visited = [], set()
+    for u in seeds:
+        if canonical_url(u) not in visited:
+            visited.add(canonical_url(u))
+            level.append(u)
+    depth = pages = 0
+    while level and pages < max_pages:
+        level = level[:max_pages - pages]
+        pages += len(level)
+        queued = []
+        for page_url, html in run_ordered(fetch_safe, level, workers=FETCH_WORKERS):
+            if not html:
+                continue
+            bump_stat("frontier_pages", stats=DISCOVERY_STATS)
+            # 抽出と同じ木を作ってリンクを探し、その木を取得側に渡す（本文は入りきらなかったときの予備）
+            soup = DOCS.parse(REDIRECTS.get(page_url, page_url), html, listing=True)
+            clinic_links = listing_clinic_links(soup, page_url)
+            next_links = list(frontier_links(soup, page_url)) if depth < max_depth else []
+            if url_in_shard(page_url):
+                if not DOCS.hold(page_url, soup):
+                    PROBE_BODIES.put(page_url, html)
+                yield page_url
+            yield from clinic_links
+            for prio, url in next_links:
+                if canonical_url(url) not in visited:
+                    visited.add(canonical_url(url))
+                    queued.append((prio, len(queued), url))
+        level = [url for _, _, url in sorted(queued)]
+        depth += 1
+    DISCOVERY_STATS.update(frontier_depth=depth, frontier_unvisited=len(level))
+
+def iter_target_urls():
+    """
+    DISCOVERY に応じて対象 URL を見つけた順に返す（取得キューへ流し込む）。
+    ・probe: START_ID〜END_ID を総当たり
+    ・sitemap / listing: 見つかったクリニックを返す
+    ・frontier: 一覧ページそのものを返す（クリニックの行は一覧のカードから作り、個別ページを二度取りしない）
+    ・sitemap / listing / frontier とも、DISCOVERY_GAP_PROBE なら START_ID〜見つかった最大 ID の欠番だけを
+      ID チェックで補う
+    """
+    if DISCOVERY_MODE == "probe":
+        yield from build_target_urls_auto()
+        return
+    if DISCOVERY_MODE == "sitemap":
+        source = iter_sitemap_clinic_urls(SITEMAP_URLS or sitemap_urls_from_robots())
+    elif DISCOVERY_MODE == "listing":
+        source = iter_listing_clinic_urls(LISTING_URLS)
+    elif DISCOVERY_MODE == "frontier":
+        source = iter_frontier_urls(FRONTIER_SEEDS)
+    else:
+        raise SystemExit(f"Unknown DISCOVERY={DISCOVERY_MODE!r} (probe / sitemap / listing / frontier)")
+
+    found = set()
+    for url in source:
+        cid = get_clinic_id_from_url(url)
+        if not cid:
+            if DISCOVERY_MODE == "frontier":
+                yield url
+            continue
+        if int(cid) in found:
+            continue
+        found.add(int(cid))
+        if not in_shard(cid):
+            continue
+        bump_stat(f"{DISCOVERY_MODE}_found", stats=DISCOVERY_STATS)
+        if DISCOVERY_MODE != "frontier":
+            yield clinic_url_for_id(int(cid))
+
+    print(f"[discovery] {DISCOVERY_MODE}: {len(found)} clinics")
+    start_id = max(1, env_int("START_ID", 1))
+    if DISCOVERY_GAP_PROBE and found and max(found) > start_id:
+        id_range = (start_id, max(found))
+        other_shards = {cid for cid in range(start_id, max(found) + 1) if not in_shard(cid)}
+        yield from build_target_urls_auto(id_range, exclude=found | other_shards)
+
+def update_id_index(results, urls):
+    """取得結果で索引を更新（取得できた → live、404/410 や別 ID への転送 → dead）"""
+    base = CLINICS_BASE_URL + "/"
+    for url, (res, _) in zip(urls, results):
+        cid = get_clinic_id_from_url(url)
+        if not (cid and url.startswith(base)):
+            continue
+        if moved_to_other_clinic(url, REDIRECTS.get(url)) or url in FETCH_GONE:
+            ID_INDEX.mark(cid, False)
+        elif res:
+            ID_INDEX.mark(cid, True)
+    ID_INDEX.save()
+
+# ---- URL canonicalization ----
+def canonical_url(u):
+    """
+    同じページを指す URL を1つの形にそろえる。
+    /clinics/12, /clinics/0012/, /clinics/0012?from=list などは ID から作り直した URL に、
+    それ以外はホストの小文字化・末尾スラッシュ・#fragment だけ正規化する（クエリは残す）。
+    """
+    u = (u or "").strip()
+    parts = urlsplit(u)
+    if not parts.scheme:
+        return u
+    if CLINIC_PATH_RE.search(parts.path):
+        return clinic_url_for_id(int(get_clinic_id_from_url(parts.path)))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+class UrlRegistry:
+    """この Run で取得を受け持ったページ（正規化 URL）。同じクリニックを二度取りしない"""
+    def __init__(self):
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+    def claim(self, url):
+        """初めてなら True（以後この URL は自分が担当）、既に誰かが担当していれば False"""
+        key = canonical_url(url)
+        with self.lock:
+            if key in self.claimed:
+                return False
+            self.claimed.add(key)
+            return True
+
+    def unique(self, source):
+        """manual / 探索結果のうち、正規化 URL で見て未取得のものだけ返す（URL 自体は書き換えない）"""
+        for u in source:
+            u = u.strip()
+            if self.claim(u):
+                yield u
+            else:
+                bump_stat("duplicate_targets", stats=DISCOVERY_STATS)
+
+TARGETS = UrlRegistry()
+
+DOC_NODE_BYTES = 700   # 木の1ノードあたりのメモリ（bs4 で 600〜750 バイト。元 HTML の 10〜40 倍になる）
+
+def document_size(doc):
+    """木のメモリの概算（ノード数 × DOC_NODE_BYTES）"""
+    if isinstance(doc, LexborNode):
+        return sum(1 for _ in doc.node.root.traverse(include_text=True)) * DOC_NODE_BYTES
+    return sum(1 for _ in doc.descendants) * DOC_NODE_BYTES
+
+class DocumentCache:
+    """
+    Run 内でパースしたクリニックページ（soup）の LRU。キーは正規化 URL。
+    一覧ページのカードが指すクリニックページを、詳細フォールバックで取り直し・パースし直ししないためのもの。
+    それ以外のページ（一覧ページなど）は後から引かれないので覚えない。
+    上限は木のノード数から見積もったメモリの合計で、超えたら古いものから捨てる。
+    frontier の探索でパースした一覧ページは hold で預かり、取得側が take で同じ木を使う（パースは1回）。
+    預かり分も同じ上限に数え、入らなければ預からない（取得側は本文から木を作り直す。held_over で数える）。
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()   # url -> (soup, size)
+        self.bytes = 0
+        self.held = {}               # url -> (soup, size)。探索から取得へ渡す一覧ページ
+        self.held_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"parsed": 0, "hits": 0, "evicted": 0, "held": 0, "held_over": 0}
+
+    def get(self, url):
+        key = canonical_url(url)
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            self.items.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[0]
+
+    def hold(self, url, soup):
+        """パース済みの一覧ページを取得側が take するまで預かる。上限を超えるなら預からずに False"""
+        size = document_size(soup)
+        with self.lock:
+            if self.bytes + self.held_bytes + size > self.max_bytes:
+                self.stats["held_over"] += 1
+                return False
+            self.held[canonical_url(url)] = (soup, size)
+            self.held_bytes += size
+            self.stats["held"] += 1
+            return True
+
+    def take(self, url):
+        """hold で預かった木を取り出す（1回限り）。無ければ None"""
+        with self.lock:
+            soup, size = self.held.pop(canonical_url(url), (None, 0))
+            self.held_bytes -= size
+            return soup
+
+    def release(self):
+        with self.lock:
+            self.held.clear()
+            self.held_bytes = 0
+
+    def parse(self, url, html, listing=False):
+        """html をパースし、クリニックページなら覚える。同じ URL がパース済みならその soup を返す"""
+        soup = self.get(url)
+        if soup is not None:
+            return soup
+        soup = make_document(html, listing=listing)
+        key = canonical_url(url)
+        if not CLINIC_PATH_RE.search(urlsplit(key).path):
+            with self.lock:
+                self.stats["parsed"] += 1
+            return soup
+        size = document_size(soup)
+        with self.lock:
+            self.stats["parsed"] += 1
+            if size > self.max_bytes or key in self.items:
+                return soup
+            self.items[key] = (soup, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, old) = self.items.popitem(last=False)
+                self.bytes -= old
+                self.stats["evicted"] += 1
+        return soup
+
+    def report(self):
+        return dict(self.stats, cached=len(self.items), cached_bytes=self.bytes, held_left=len(self.held))
+
+DOCS = DocumentCache(int(DOC_CACHE_MB * 1024 * 1024))
+
+def load_document(url):
+    """DOCS にあればその soup、無ければ取得してパースする。取得できなければ None"""
+    soup = DOCS.get(url)
+    if soup is None:
+        html = fetch_safe(url)
+        soup = DOCS.parse(REDIRECTS.get(url, url), html) if html else None
+    return soup
 
 # ---- Parse helpers ----
+def resolve_parser(name):
+    """BeautifulSoup のツリービルダー名。lxml が未導入なら html.parser に戻す"""
+    if name in ("auto", "lxml"):
+        try:
+            import lxml  # noqa: F401
+            return "lxml"
+        except ImportError:
+            if name == "lxml":
+                print("[Parser] lxml is not installed; falling back to html.parser")
+            return "html.parser"
+    return name
+
+SOUP_PARSER = resolve_parser(PARSER_BACKEND)
+
+def make_soup(html, parser=None, parse_only=None):
+    return BeautifulSoup(html, parser or SOUP_PARSER, parse_only=parse_only)
+
+class RegionStrainer(SoupStrainer):
+    """
+    抽出で見る領域だけを木に残す SoupStrainer（PARSE_MODE=partial）。
+    一致したタグは子孫ごと残るので、カード/パンくず/メニュー/表の中の要素はそのまま使える。
+    parse_card・parse_breadcrumbs・extract_*_from_scope・fetch_menu_image_from_detail のセレクタを変えたらここも合わせる。
+    """
+    KEEP_TAGS = {"title", "h1", "table", "img"}
+    KEEP_CLASSES = {"clinic-list__card", "breadcrumb", "small-list__item", "kds-line-height-0"}
+
+    def __init__(self, links=False):
+        super().__init__()
+        self.links = links   # frontier の一覧ページ: ページ送りと辿るリンク（frontier_links）も残す
+
+    def keep(self, name, attrs):
+        if name in self.KEEP_TAGS or (self.links and name == "a"):
+            return True
+        attrs = dict(attrs or {})
+        if name == "meta":
+            return attrs.get("property") == "og:image"
+        classes = attrs.get("class") or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        if self.links and "pagination" in classes:
+            return True
+        return not self.KEEP_CLASSES.isdisjoint(classes)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):   # bs4 >= 4.13
+        return self.keep(name, attrs)
+
+    def allow_string_creation(self, string):               # 残す領域の外の文字列は捨てる
+        return False
+
+    def search_tag(self, markup_name=None, markup_attrs={}):   # bs4 < 4.13
+        return markup_name if self.keep(markup_name, markup_attrs) else None
+
+EXTRACT_STRAINER = RegionStrainer() if PARSE_MODE == "partial" else None
+LISTING_STRAINER = RegionStrainer(links=True) if PARSE_MODE == "partial" else None
+
+class LexborNode:
+    """
+    selectolax(lexbor) のノードを、抽出関数が使う範囲だけ BeautifulSoup の Tag に見せる薄いラッパ。
+    select / select_one / find / find_all / get / get_text / has_attr / [] / title / string のみ。
+    抽出ロジックは bs4 と共通のまま、パースと CSS 検索だけ C 実装に任せる。
+    """
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    def select(self, css):
+        # lexbor はカンマ区切りの各候補ごとに同じ要素を返すので、文書順のまま重複を除く（bs4 と同じ）
+        seen, found = set(), []
+        for n in self.node.css(css):
+            if n.mem_id not in seen:
+                seen.add(n.mem_id)
+                found.append(LexborNode(n))
+        return found
+
+    def select_one(self, css):
+        n = self.node.css_first(css)
+        return LexborNode(n) if n is not None else None
+
+    find_all = select
+    find = select_one
+
+    def get(self, key, default=None):
+        attrs = self.node.attributes
+        if key not in attrs:
+            return default
+        return attrs[key] or ""   # 値なし属性は bs4 と同じく ""
+
+    def has_attr(self, key):
+        return key in self.node.attributes
+
+    def __getitem__(self, key):
+        return self.node.attributes[key] or ""
+
+    def get_text(self, separator=""):
+        return self.node.text(deep=True, separator=separator)
+
+    @property
+    def title(self):
+        return self.select_one("title")
+
+    @property
+    def string(self):
+        """bs4 と同じく、子が1つだけのときだけその文字列（子要素なら再帰）。それ以外は None"""
+        node = self.node
+        while True:
+            children = list(node.iter(include_text=True))
+            if len(children) != 1:
+                return None
+            node = children[0]
+            if node.tag == "-text":
+                return node.text()
+
+def resolve_engine(name):
+    if name in ("lexbor", "selectolax"):
+        try:
+            import selectolax.lexbor  # noqa: F401
+            return "lexbor"
+        except ImportError:
+            print("[Parser] selectolax is not installed; falling back to bs4")
+    return "bs4"
+
+EXTRACT_BACKEND = resolve_engine(EXTRACT_ENGINE)
+
+def make_document(html, listing=False):
+    """
+    行の抽出に使う木。EXTRACT_BACKEND=lexbor なら LexborNode、それ以外は soup（PARSE_MODE に従う）。
+    listing=True は frontier の一覧ページ用で、partial でもリンクを残す（同じ木でリンク探索と行の抽出を行う）。
+    """
+    if EXTRACT_BACKEND == "lexbor":
+        from selectolax.lexbor import LexborHTMLParser
+        tree = LexborHTMLParser(html)
+        tree.strip_tags(["script", "style"])   # bs4 の get_text は script/style の中身を含めない
+        return LexborNode(tree)
+    return make_soup(html, parse_only=LISTING_STRAINER if listing else EXTRACT_STRAINER)
+
 TIME_RANGE_RE = re.compile(r"(?P<open>\d{1,2}:\d{2}).*?(?P<close>\d{1,2}:\d{2})")
 WEEK_DAYS = ["月", "火", "水", "木", "金", "土", "日"]
 
@@ -178,14 +1814,70 @@ def to_abs_url(maybe_url: str, page_url: str) -> str:
         return "https:" + maybe_url
     return urljoin(page_url, maybe_url)
 
+OG_IMAGE_META_RE = re.compile(rb"<meta\b[^>]*\bproperty\s*=\s*[\"']og:image[\"'][^>]*>", re.I)
+META_CONTENT_RE = re.compile(rb"\bcontent\s*=\s*(?:\"([^\"]*)\"|'([^']*)')", re.I)
+HEAD_END_RE = re.compile(rb"</head\s*>", re.I)
+OG_STREAM_STATS = {"streamed": 0, "found": 0, "no_og_in_head": 0, "errors": 0, "bytes_read": 0}
+
+def fetch_og_image_streamed(url, chunk_size=8192, max_bytes=MENU_IMG_STREAM_MAX_BYTES):
+    """
+    本文を少しずつ読み、og:image を見つけた時点（または </head> を過ぎた時点）で打ち切る。
+    見つかれば content 値、<head> に無ければ ""、ページが無い（404/410）かブレーカーが開いていれば None。
+    それ以外の失敗（429/5xx/通信エラーなど）も "" を返し、リトライつきの全体取得に任せる。
+    ※途中で閉じたコネクションはプールに戻らない（ヘッダ分の転送量削減を優先）
+    """
+    try:
+        r = http_request("GET", url, timeout=(5, TIMEOUT), stream=True)
+    except Exception as e:
+        print(f"[menu_img stream err] {url}: {e}")
+        bump_stat("errors", stats=OG_STREAM_STATS)
+        return None if isinstance(e, CircuitOpenError) else ""
+    buf = b""
+    try:
+        if r.status_code != 200:
+            bump_stat("errors", stats=OG_STREAM_STATS)
+            return None if r.status_code in (404, 410) else ""
+        bump_stat("streamed", stats=OG_STREAM_STATS)
+        for chunk in r.iter_content(chunk_size):
+            buf += chunk
+            m = OG_IMAGE_META_RE.search(buf)
+            if m:
+                c = META_CONTENT_RE.search(m.group(0))
+                if c:
+                    bump_stat("found", stats=OG_STREAM_STATS)
+                    raw = c.group(1) if c.group(1) is not None else c.group(2)
+                    return unescape(raw.decode(r.encoding or "utf-8", "replace")).strip()
+            if HEAD_END_RE.search(buf) or len(buf) >= max_bytes:
+                break
+        bump_stat("no_og_in_head", stats=OG_STREAM_STATS)
+        return ""
+    except Exception as e:
+        print(f"[menu_img stream err] {url}: {e}")
+        bump_stat("errors", stats=OG_STREAM_STATS)
+        return ""
+    finally:
+        bump_stat("bytes_read", len(buf), stats=OG_STREAM_STATS)
+        r.close()
+        record_transfer(url, r, len(buf))
+
 def fetch_menu_image_from_detail(url):
     """メニュー詳細ページから代表画像を取得。優先: og:image → .kds-line-height-0 img → 最初の img"""
+    # 0) キャッシュが無ければ <head> だけ読んで og:image を探す。
+    #    ページが無い（404/410）かブレーカーが開いていれば取り直さない。それ以外はリトライつきの全体取得へ
+    if MENU_IMG_STREAM and not RESPONSE_CACHE.has(url):
+        og = fetch_og_image_streamed(url)
+        if og:
+            return to_abs_url(og, url)
+        if og is None:
+            print(f"[menu_img] fetch failed: {url}")
+            return ""
+
     html = fetch_safe(url)
     if not html:
         print(f"[menu_img] fetch failed: {url}")
         return ""
 
-    soup = BeautifulSoup(html, "html.parser")
+    soup = make_document(html)
 
     # 1) og:image
     og = soup.select_one('meta[property="og:image"]')
@@ -238,7 +1930,6 @@ def extract_menus_from_scope(scope, base_url=None):
         # 見つからなければ詳細ページで取得
         if not menu_img and follow_detail and menu_url:
             menu_img = fetch_menu_image_from_detail(menu_url)
-            time.sleep(0.2)  # polite
 
         menus.append({
             "title": title,
@@ -299,8 +1990,10 @@ def parse_card(card, base_url=None):
         "hours": hours, "menus": menus
     }
 
-def parse_page(html, page_url):
-    soup = BeautifulSoup(html, "html.parser")
+def parse_page(html, page_url, soup=None):
+    """soup を渡せばそれを使う（DOCS でパース済みのもの。LexborNode でもよい）"""
+    if soup is None:
+        soup = make_document(html)
     cards = [parse_card(c, base_url=page_url) for c in soup.select(".card.clinic-list__card")]
     if not cards:  # fallback 単体ページ
         title = clean_text(soup.title.string if soup.title else "")
@@ -388,6 +2081,7 @@ MENUS_HEADER = [
 HOURS_HEADER = [
     "timestamp_utc","clinic_id","day","open_time","close_time","raw"
 ]
+TRANSFER_HEADER = ["url","status","content_encoding","wire_bytes","body_bytes"]
 
 def write_three_sheets(clinics_rows, menus_rows, hours_rows):
     json_b64 = os.getenv("GSHEET_JSON_B64")
@@ -453,7 +2147,10 @@ def write_settings_sheet():
         {"key":"GSHEET_KEY", "value": sheet_key, "note":"スプレッドシートID", "updated_utc": now},
         {"key":"GSHEET_JSON_B64", "value": masked_summary(json_b64), "note":"Secrets。値は保存しない。", "updated_utc": now},
         {"key":"MENU_IMG_FOLLOW", "value": os.getenv("MENU_IMG_FOLLOW","true"), "note":"詳細ページまで追跡して画像取得", "updated_utc": now},
+        {"key":"SHARD_COUNT", "value": str(SHARD_COUNT), "note":"並列ジョブ数（merge で結合）", "updated_utc": now},
     ]
+    if "detected_ceiling" in DISCOVERY_STATS:
+        rows.append({"key":"DETECTED_CEILING", "value": DISCOVERY_STATS["detected_ceiling"], "note":"END_ID=auto で検出した最大 live ID", "updated_utc": now})
     append_rows(ws, rows)
     print(f"[Settings] wrote {len(rows)} rows")
 
@@ -485,132 +2182,410 @@ def save_csv(df, path):
     df.to_csv(path, index=False, encoding="utf-8-sig")
     print(f"[Saved] {path}")
 
+def write_run_report(out_dir):
+    """実行サマリ（HTTP 統計など）を run_report.json に保存"""
+    report = {"finished_utc": now_utc_iso(), "http": http_pool_stats(),
+              "rate_limit": RATE_LIMITER.stats(), "concurrency": CONCURRENCY.stats(),
+              "retry": RETRY_POLICY.report(), "http_cache": RESPONSE_CACHE.report(),
+              "og_image_stream": dict(OG_STREAM_STATS), "circuit_breaker": BREAKER.report(),
+              "transfer": transfer_summary(), "discovery": dict(DISCOVERY_STATS),
+              "probe_bodies": PROBE_BODIES.report(), "parser": SOUP_PARSER, "extract_engine": EXTRACT_BACKEND,
+              "parse_workers": PARSE_WORKERS, "documents": DOCS.report()}
+    h = report["http"]
+    print(f"[HTTP] backend={h['backend']} versions={h['http_versions']} requests={h['requests']} errors={h['errors']} "
+          f"new_connections={h['new_connections']} reuse_rate={h['reuse_rate']:.1%}")
+    hc = report["http_cache"]
+    print(f"[HTTP cache] hits={hc['hits']} misses={hc['misses']} "
+          f"changed={hc['revalidated_changed']} stored={hc['stored']} hit_rate={hc['hit_rate']:.1%}")
+    t = report["transfer"]
+    print(f"[Transfer] wire={t['wire_bytes'] / 1e6:.1f}MB body={t['body_bytes'] / 1e6:.1f}MB "
+          f"ratio={t['compression_ratio']} encodings={t['encodings']}")
+    c = report["concurrency"]
+    print(f"[Concurrency] final={c['final']} range={c['min_seen']}..{c['max_seen']} changes={len(c['history']) - 1}")
+    path = os.path.join(out_dir, "run_report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[Saved] {path}")
+    if TRANSFER_LOG:
+        save_csv(pd.DataFrame(TRANSFER_LOG, columns=TRANSFER_HEADER), os.path.join(out_dir, "transfer.csv"))
+
+# ---- Fetch engine ----
+def scrape_page(source_page_url, ts):
+    """1ページ分の取得→解析→行生成。スキップ時は None。"""
+    t0 = time.time()
+    print(f"[Fetch] {source_page_url}")
+
+    # frontier の一覧ページは探索でパース済みの木をそのまま使う
+    doc = DOCS.take(source_page_url)
+    html = None if doc is not None else PROBE_BODIES.take(source_page_url) or fetch_safe(source_page_url)
+    if doc is None and not html:
+        print(f"[Skip] empty html: {source_page_url}")
+        return None
+
+    # リダイレクト先が別のクリニックなら、そちらとして扱う（既に取得済みなら捨てる）
+    page_url = REDIRECTS.get(source_page_url, source_page_url)
+    if page_url != source_page_url:
+        bump_stat("redirects", stats=DISCOVERY_STATS)
+        if not TARGETS.claim(page_url):
+            print(f"[Dup] {source_page_url} -> {page_url} (already fetched)")
+            bump_stat("duplicate_redirects", stats=DISCOVERY_STATS)
+            return None
+
+    if doc is not None:
+        res = build_page_rows(source_page_url, page_url, doc, ts)
+    elif PARSE_WORKERS > 0:
+        res = build_page_rows_pooled(source_page_url, page_url, html, ts)
+    else:
+        res = build_page_rows(source_page_url, page_url, DOCS.parse(page_url, html), ts)
+    elapsed = time.time() - t0
+    print(f"[Done] {source_page_url} ({elapsed:.1f}s)")
+    return res
+
+def build_page_rows(source_page_url, page_url, doc, ts):
+    """パース済みページ（soup / LexborNode）から、カードと3シート分の行を作る"""
+    cards, soup = parse_page(None, page_url, soup=doc)
+    complete_cards(cards, page_url, soup)
+    return page_rows(source_page_url, page_url, cards, parse_breadcrumbs(soup, source_page_url), ts)
+
+def complete_cards(cards, page_url, soup, fetch=True):
+    """
+    メニュー/営業時間が空のカードを、クリニックページ全体から補完する。
+    soup が None なら同じページの分は済んでいる（パースワーカー側）。fetch=False なら別ページは取りに行かない。
+    """
+    for c in cards:
+        clinic_url = c.get("clinic_url") or page_url
+        need_menus = len(c.get("menus") or []) == 0
+        need_hours = len(c.get("hours") or {}) == 0
+        if not ((need_menus or need_hours) and clinic_url):
+            continue
+        same_page = canonical_url(clinic_url) == canonical_url(page_url)
+        if (same_page and soup is None) or (not same_page and not fetch):
+            continue
+        try:
+            detail_soup = soup if same_page else load_document(clinic_url)
+            if detail_soup is not None:
+                if need_menus:
+                    extra_menus = extract_menus_from_scope(detail_soup, base_url=clinic_url)
+                    if extra_menus:
+                        c["menus"] = extra_menus
+                if need_hours:
+                    extra_hours = extract_hours_from_scope(detail_soup)
+                    if extra_hours:
+                        c["hours"] = extra_hours
+        except Exception as e:
+            print(f"[Fallback warn] detail fetch failed for {clinic_url}: {e}")
+
+def page_rows(source_page_url, page_url, cards, bc, ts):
+    """カードとパンくずから clinics / menus / hours の行を組み立てる"""
+    clinics_rows, menus_rows, hours_rows = [], [], []
+    breadcrumb_list = bc.get("breadcrumb_list", [])
+    prefecture = bc.get("prefecture", "")
+    city = bc.get("city", "")
+    station = bc.get("station", "")
+    breadcrumb_json = json.dumps(breadcrumb_list, ensure_ascii=False)
+
+    for c in cards:
+        clinic_url = c.get("clinic_url") or page_url
+        clinic_id = get_clinic_id_from_url(canonical_url(clinic_url))   # /clinics/12 と /clinics/0012 を同じ ID に
+
+        images_csv   = ",".join([x for x in c.get("images", []) if x])
+        features_csv = ",".join([x for x in c.get("features", []) if x])
+        hours_json   = json.dumps(c.get("hours", {}), ensure_ascii=False)
+
+        notes = []
+        if c.get("rating") is not None: notes.append(f"rating={c['rating']}")
+        if c.get("reviews") is not None: notes.append(f"reviews={c['reviews']}")
+        if len(c.get("menus") or []) == 0: notes.append("menus=0")
+        if len(c.get("hours") or {}) == 0: notes.append("hours=0")
+        notes_str = ", ".join(notes)
+
+        # clinics
+        clinics_rows.append({
+            "timestamp_utc": ts,
+            "clinic_id": clinic_id,
+            "name": c.get("name",""),
+            "rank": c.get("rank"),
+            "rating": c.get("rating"),
+            "reviews_count": c.get("reviews"),
+            "clinic_url": clinic_url,
+            "source_page_url": source_page_url,
+            "prefecture": prefecture,
+            "city": city,
+            "station": station,
+            "access_text": c.get("access",""),
+            "snippet": c.get("snippet",""),
+            "snippet_author": c.get("snippet_author",""),
+            "images_csv": images_csv,
+            "features_csv": features_csv,
+            "hours_json": hours_json,
+            "breadcrumb_json": breadcrumb_json,
+            "last_seen_utc": ts,
+            "status": "ok",
+            "notes": notes_str
+        })
+
+        # menus
+        for m in c.get("menus", []):
+            menus_rows.append({
+                "timestamp_utc": ts,
+                "clinic_id": clinic_id,
+                "menu_title": m.get("title",""),
+                "price_jpy": m.get("price_jpy"),
+                "price_raw": m.get("price_raw",""),
+                "menu_url": m.get("url",""),
+                "pickup_flag": m.get("pickup_flag"),
+                "category_raw": m.get("category_raw",""),
+                "menu_img": m.get("menu_img",""),
+            })
+
+        # hours
+        for day, raw in (c.get("hours") or {}).items():
+            open_time, close_time = split_open_close(raw)
+            hours_rows.append({
+                "timestamp_utc": ts,
+                "clinic_id": clinic_id,
+                "day": day,
+                "open_time": open_time,
+                "close_time": close_time,
+                "raw": raw
+            })
+
+    return {"cards": cards, "clinics": clinics_rows, "menus": menus_rows, "hours": hours_rows}
+
+# ---- Parse workers (process pool) ----
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def parse_worker_init():
+    # ワーカーはネットワークに出ない。メニュー画像の追跡は親プロセスで行う
+    os.environ["MENU_IMG_FOLLOW"] = "false"
+
+def get_parse_pool():
+    """
+    パース用のプロセスプール。spawn で起動するのでスレッドを抱えた親を fork しない。
+    投入は取得スレッドが結果を待つ形なので、処理中のページは最大 FETCH_WORKERS 件（これが背圧になる）。
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, initializer=parse_worker_init,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+                print(f"[Parse pool] workers={PARSE_WORKERS}")
+    return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+def parse_page_worker(source_page_url, page_url, html):
+    """ワーカープロセス側: パース → 同じページでの補完 → パンくず。カードとパンくずを素の dict で返す"""
+    cards, soup = parse_page(None, page_url, soup=make_document(html))
+    complete_cards(cards, page_url, soup, fetch=False)
+    return cards, parse_breadcrumbs(soup, source_page_url)
+
+def fill_menu_images(cards):
+    """ワーカーで追わなかったメニュー画像を詳細ページから取る（MENU_IMG_FOLLOW=true のとき）"""
+    if os.getenv("MENU_IMG_FOLLOW", "true").lower() != "true":
+        return
+    for c in cards:
+        for m in c.get("menus") or []:
+            if not m.get("menu_img") and m.get("url"):
+                m["menu_img"] = fetch_menu_image_from_detail(m["url"])
+
+def build_page_rows_pooled(source_page_url, page_url, html, ts):
+    """
+    パースはプロセスプールに任せ、ネットワークが要る補完と行の組み立てだけこのスレッドで行う。
+    木はワーカー側で作って捨てるので DOCS には残らない。後から一覧カードがこのページを指したときは
+    load_document で取り直してパースする（プールを使うときの例外。HTTP キャッシュがあれば取り直しは 304）。
+    """
+    try:
+        cards, bc = get_parse_pool().submit(parse_page_worker, source_page_url, page_url, html).result()
+    except Exception as e:
+        print(f"[Parse pool] {page_url}: {e!r}; parsing inline")
+        bump_stat("parse_pool_fallbacks", stats=DISCOVERY_STATS)
+        return build_page_rows(source_page_url, page_url, DOCS.parse(page_url, html), ts)
+    fill_menu_images(cards)
+    complete_cards(cards, page_url, None)
+    return page_rows(source_page_url, page_url, cards, bc, ts)
+
+def scrape_page_guarded(source_page_url, ts):
+    """scrape_page の結果と、ブレーカーで送らなかったリクエスト URL の一覧を返す"""
+    BREAKER.begin_page()
+    try:
+        res = scrape_page(source_page_url, ts)
+    finally:
+        skipped = BREAKER.end_page()
+    return res, skipped
+
+def run_ordered(func, items, workers=FETCH_WORKERS):
+    """
+    items を最大 workers 並列で func に流し、結果は入力順に (item, result) で返す。
+    先行して投入するのは workers*2 件までなので、items はジェネレータでもよい。
+    """
+    window = max(1, workers) * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for item in items:
+            pending.append((item, ex.submit(func, item)))
+            if len(pending) >= window:
+                head, fut = pending.popleft()
+                yield head, fut.result()
+        while pending:
+            head, fut = pending.popleft()
+            yield head, fut.result()
+
+def prefetch(source, maxsize=DISCOVERY_QUEUE):
+    """
+    source を別スレッドで先に回し、最大 maxsize 件までキューに貯めて返す。
+    取得側が詰まっている間も探索（ID チェック）が止まらないようにするため。
+    スレッドは呼んだ時点で動き出す。source 側の例外は受け取り側で投げ直す。
+    """
+    if maxsize <= 0:
+        return iter(source)
+    q = Queue(maxsize)
+
+    def produce():
+        try:
+            for item in source:
+                q.put((True, item))
+            q.put((False, None))
+        except BaseException as e:
+            q.put((False, e))
+
+    def drain():
+        while True:
+            ok, item = q.get()
+            if ok:
+                yield item
+            elif item is None:
+                return
+            else:
+                raise item
+
+    threading.Thread(target=produce, name="discovery", daemon=True).start()
+    return drain()
+
 # ---- main ----
 def main():
-    urls = load_urls_from_env()
-    if not urls:
-        urls = build_target_urls_auto()
-    if not urls:
-        raise SystemExit("No valid clinic pages found")
-
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        raise SystemExit(f"SHARD_INDEX({SHARD_INDEX}) must be in 0..{SHARD_COUNT - 1}")
+    sharded = SHARD_COUNT > 1
     out_dir = os.getenv("OUTPUT_DIR", "output")
+    if sharded:
+        out_dir = os.path.join(out_dir, f"shard-{SHARD_INDEX:02d}")
+        print(f"[Shard] {SHARD_INDEX + 1}/{SHARD_COUNT} -> {out_dir}")
     os.makedirs(out_dir, exist_ok=True)
-    write_targets_sheet(urls)
 
     ts = now_utc_iso()
     clinics_rows, menus_rows, hours_rows = [], [], []
     all_cards = []
 
-    for source_page_url in urls:
-        t0 = time.time()
-        print(f"[Fetch] {source_page_url}")
+    # 手動 URL が無ければ探索結果を見つけた順に取得キューへ流す
+    urls = []
+    def track(source):
+        for u in source:
+            urls.append(u)
+            yield u
+
+    print(f"[Engine] workers={FETCH_WORKERS} concurrency={CONCURRENCY.limit} rate={REQUESTS_PER_SEC}/s")
+    manual = load_urls_from_env()
+    source = shard_slice(manual) if manual else prefetch(iter_target_urls())
+    source = TARGETS.unique(source)
+    results = [res for _, res in run_ordered(lambda u: scrape_page_guarded(u, ts), track(source))]
+
+    # ブレーカーで送れなかった存在チェックは冷却後にやり直し、live なら取得する。
+    # half-open の試行中に断られただけのものは、試行が通ればもう一度回す
+    recheck = sorted(PROBE_SKIPPED)
+    while recheck:
+        BREAKER.wait_for_cooldown()
+        with _stats_lock:
+            PROBE_SKIPPED.difference_update(recheck)
+        print(f"[Resume] {len(recheck)} probes skipped by circuit breaker")
+        live = []
+        for u, status in run_ordered(probe_status, recheck, workers=PROBE_WORKERS):
+            record_probe(get_clinic_id_from_url(u), status)
+            if status == 200:
+                live.append(u)
+        for u, res in run_ordered(lambda u: scrape_page_guarded(u, ts), TARGETS.unique(live)):
+            urls.append(u)
+            results.append(res)
+        again = sorted(BREAKER.retryable(PROBE_SKIPPED))
+        recheck = again if len(again) < len(recheck) else []   # 減らなければ打ち切る
+
+    # ブレーカーでスキップされたページは冷却後にもう一度だけ取り直す（half-open の試行中に断られただけのものは再度）
+    resume = [i for i, (_, skipped) in enumerate(results) if skipped]
+    while resume:
+        BREAKER.wait_for_cooldown()
+        print(f"[Resume] {len(resume)} pages skipped by circuit breaker")
+        retried = run_ordered(lambda i: scrape_page_guarded(urls[i], ts), resume)
+        for i, (res, skipped) in retried:
+            if res or not results[i][0]:
+                results[i] = (res, skipped)
+        again = [i for i in resume
+                 if results[i][1] and len(BREAKER.retryable(results[i][1])) == len(results[i][1])]
+        resume = again if len(again) < len(resume) else []   # 減らなければ打ち切る
+    leftover = [urls[i] for i, (_, skipped) in enumerate(results) if skipped] + sorted(PROBE_SKIPPED)
+    if leftover:
+        path = os.path.join(out_dir, "skipped_urls.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(leftover) + "\n")
+        print(f"[Saved] {path} ({len(leftover)} urls; pass as TARGET_URLS to resume)")
+
+    update_id_index(results, urls)
+    PROBE_BODIES.clear()
+    DOCS.release()
+    shutdown_parse_pool()
+    if "detected_ceiling" in DISCOVERY_STATS:
+        with open(os.path.join(out_dir, "_meta.txt"), "a", encoding="utf-8") as f:
+            f.write(f"detected_ceiling={DISCOVERY_STATS['detected_ceiling']}\n")
+    # 再開パスと skipped_urls.txt・索引の保存を済ませてから判定する（ブレーカーで全滅しても再開できるように）
+    if not urls and not sharded:
+        raise SystemExit("No valid clinic pages found")
 
-        html = fetch_safe(source_page_url)
-        if not html:
-            print(f"[Skip] empty html: {source_page_url}")
-            continue
+    for res, _ in results:
+        if res:
+            all_cards.extend(res["cards"])
+    collect_rows([res for res, _ in results if res], clinics_rows, menus_rows, hours_rows)
+
+    save_outputs(out_dir, clinics_rows, menus_rows, hours_rows, all_cards)
+    RESPONSE_CACHE.prune(HTTP_CACHE_MAX_AGE_DAYS)
+    write_run_report(out_dir)
+
+    if sharded:
+        # Sheets は merge で1回だけ書く。型を保ったまま結合できるよう行データも残す
+        with open(os.path.join(out_dir, "rows.json"), "w", encoding="utf-8") as f:
+            json.dump({"clinics": clinics_rows, "menus": menus_rows, "hours": hours_rows}, f, ensure_ascii=False)
+        with open(os.path.join(out_dir, "_shard.json"), "w", encoding="utf-8") as f:
+            json.dump({"index": SHARD_INDEX, "count": SHARD_COUNT, "urls": urls,
+                       "detected_ceiling": DISCOVERY_STATS.get("detected_ceiling")}, f, ensure_ascii=False, indent=2)
+        ID_INDEX.save(os.path.join(out_dir, "id_index.json"))   # merge で全シャード分を1つにまとめる
+        print(f"[Shard] saved partial outputs to {out_dir} (run 'scrape.py merge' to combine)")
+        return
 
-        cards, soup = parse_page(html, source_page_url)
-        all_cards.extend(cards)
-
-        # パンくず抽出（ページ単位）
-        bc = parse_breadcrumbs(soup, source_page_url)
-        breadcrumb_list = bc.get("breadcrumb_list", [])
-        prefecture = bc.get("prefecture", "")
-        city = bc.get("city", "")
-        station = bc.get("station", "")
-        breadcrumb_json = json.dumps(breadcrumb_list, ensure_ascii=False)
-
-        for c in cards:
-            clinic_url = c.get("clinic_url") or source_page_url
-            clinic_id = get_clinic_id_from_url(clinic_url)
-
-            # ---- フォールバック: ページ全体から補完 ----
-            need_menus = len(c.get("menus") or []) == 0
-            need_hours = len(c.get("hours") or {}) == 0
-            if (need_menus or need_hours) and clinic_url:
-                try:
-                    detail_html = html if clinic_url == source_page_url else fetch_safe(clinic_url)
-                    if detail_html:
-                        detail_soup = BeautifulSoup(detail_html, "html.parser")
-                        if need_menus:
-                            extra_menus = extract_menus_from_scope(detail_soup, base_url=clinic_url)
-                            if extra_menus:
-                                c["menus"] = extra_menus
-                        if need_hours:
-                            extra_hours = extract_hours_from_scope(detail_soup)
-                            if extra_hours:
-                                c["hours"] = extra_hours
-                except Exception as e:
-                    print(f"[Fallback warn] detail fetch failed for {clinic_url}: {e}")
-
-            images_csv   = ",".join([x for x in c.get("images", []) if x])
-            features_csv = ",".join([x for x in c.get("features", []) if x])
-            hours_json   = json.dumps(c.get("hours", {}), ensure_ascii=False)
-
-            notes = []
-            if c.get("rating") is not None: notes.append(f"rating={c['rating']}")
-            if c.get("reviews") is not None: notes.append(f"reviews={c['reviews']}")
-            if len(c.get("menus") or []) == 0: notes.append("menus=0")
-            if len(c.get("hours") or {}) == 0: notes.append("hours=0")
-            notes_str = ", ".join(notes)
-
-            # clinics
-            clinics_rows.append({
-                "timestamp_utc": ts,
-                "clinic_id": clinic_id,
-                "name": c.get("name",""),
-                "rank": c.get("rank"),
-                "rating": c.get("rating"),
-                "reviews_count": c.get("reviews"),
-                "clinic_url": clinic_url,
-                "source_page_url": source_page_url,
-                "prefecture": prefecture,
-                "city": city,
-                "station": station,
-                "access_text": c.get("access",""),
-                "snippet": c.get("snippet",""),
-                "snippet_author": c.get("snippet_author",""),
-                "images_csv": images_csv,
-                "features_csv": features_csv,
-                "hours_json": hours_json,
-                "breadcrumb_json": breadcrumb_json,
-                "last_seen_utc": ts,
-                "status": "ok",
-                "notes": notes_str
-            })
+    # Sheets
+    write_targets_sheet(urls)
+    write_three_sheets(clinics_rows, menus_rows, hours_rows)
+    write_settings_sheet()
 
-            # menus
-            for m in c.get("menus", []):
-                menus_rows.append({
-                    "timestamp_utc": ts,
-                    "clinic_id": clinic_id,
-                    "menu_title": m.get("title",""),
-                    "price_jpy": m.get("price_jpy"),
-                    "price_raw": m.get("price_raw",""),
-                    "menu_url": m.get("url",""),
-                    "pickup_flag": m.get("pickup_flag"),
-                    "category_raw": m.get("category_raw",""),
-                    "menu_img": m.get("menu_img",""),
-                })
-
-            # hours
-            for day, raw in (c.get("hours") or {}).items():
-                open_time, close_time = split_open_close(raw)
-                hours_rows.append({
-                    "timestamp_utc": ts,
-                    "clinic_id": clinic_id,
-                    "day": day,
-                    "open_time": open_time,
-                    "close_time": close_time,
-                    "raw": raw
-                })
-
-        elapsed = time.time() - t0
-        print(f"[Done] {source_page_url} ({elapsed:.1f}s)")
-        time.sleep(SLEEP_BETWEEN)
-
-    # 保存
+def collect_rows(parts, clinics_rows, menus_rows, hours_rows):
+    """
+    ページ（またはシャード）ごとの行を順に足す。
+    一覧ページのカードと個別ページ、別々のシャードで同じクリニックが出たら、先に出た方だけ残す。
+    """
+    emitted = set()
+    for part in parts:
+        dup = {r["clinic_id"] for r in part["clinics"] if r["clinic_id"] in emitted}
+        emitted.update(r["clinic_id"] for r in part["clinics"] if r["clinic_id"])
+        if dup:
+            bump_stat("duplicate_clinic_rows", len(dup), stats=DISCOVERY_STATS)
+        clinics_rows.extend(r for r in part["clinics"] if r["clinic_id"] not in dup)
+        menus_rows.extend(r for r in part["menus"] if r["clinic_id"] not in dup)
+        hours_rows.extend(r for r in part["hours"] if r["clinic_id"] not in dup)
+
+def save_outputs(out_dir, clinics_rows, menus_rows, hours_rows, all_cards):
     df_clinics = pd.DataFrame(clinics_rows, columns=CLINICS_HEADER)
     df_menus   = pd.DataFrame(menus_rows,   columns=MENUS_HEADER)
     df_hours   = pd.DataFrame(hours_rows,   columns=HOURS_HEADER)
@@ -619,13 +2594,110 @@ def main():
     save_csv(df_menus,   os.path.join(out_dir, "menus.csv"))
     save_csv(df_hours,   os.path.join(out_dir, "hours.csv"))
 
-    with open(os.path.join(out_dir, "cards.json"), "w", encoding="utf-8") as f:
+    path = os.path.join(out_dir, "cards.json")
+    with open(path, "w", encoding="utf-8") as f:
         json.dump(all_cards, f, ensure_ascii=False, indent=2)
-    print("[Saved] output/cards.json")
+    print(f"[Saved] {path}")
 
-    # Sheets
+# ---- merge (sharded runs) ----
+def merge_shards():
+    """
+    OUTPUT_DIR/shard-NN/ の部分出力をシャード番号順に結合する。
+    ・ID 範囲（END_ID が数値か plan ジョブで検出済み）と TARGET_URLS は連続区間で分けているので、
+      番号順に並べれば単一 Run と同じ並びになる
+    ・sitemap / listing と、各シャードで上限を検出した END_ID=auto は ID の剰余、frontier の一覧ページは
+      URL のハッシュで分けているので、並びはシャード番号順（単一 Run とは異なる）
+    シャードをまたいだ同じ clinic_id は先に出た方だけ残す。Sheets への書き込みはここで1回だけ行い、
+    欠けたシャードがあれば結合したファイルだけ残して書き込まずに失敗する。
+    """
+    out_dir = os.getenv("OUTPUT_DIR", "output")
+    shards = []
+    for meta_path in glob(os.path.join(out_dir, "shard-*", "_shard.json")):
+        with open(meta_path, encoding="utf-8") as f:
+            shards.append((json.load(f), os.path.dirname(meta_path)))
+    if not shards:
+        raise SystemExit(f"No shard outputs found under {out_dir}/shard-*")
+    shards.sort(key=lambda x: x[0]["index"])
+
+    counts = {meta["count"] for meta, _ in shards}
+    expected = max(counts)
+    missing = sorted(set(range(expected)) - {meta["index"] for meta, _ in shards})
+    if len(counts) > 1:
+        print(f"[merge warn] shards disagree on SHARD_COUNT: {sorted(counts)}")
+    if missing:
+        print(f"[merge warn] missing shards: {missing} (their rows are not included; Sheets are not written)")
+
+    ceiling_index = os.path.join(out_dir, "ceiling", "id_index.json")   # plan ジョブの上限探索で確認した ID
+    if os.path.exists(ceiling_index):
+        ID_INDEX.update(IdIndex(ceiling_index))
+
+    urls, parts, all_cards, skipped, reports, ceilings = [], [], [], [], [], set()
+    for meta, shard_dir in shards:
+        urls.extend(meta.get("urls", []))
+        if meta.get("detected_ceiling") is not None:
+            ceilings.add(meta["detected_ceiling"])
+        with open(os.path.join(shard_dir, "rows.json"), encoding="utf-8") as f:
+            rows = json.load(f)
+        parts.append(rows)
+        with open(os.path.join(shard_dir, "cards.json"), encoding="utf-8") as f:
+            all_cards.extend(json.load(f))
+        skipped_path = os.path.join(shard_dir, "skipped_urls.txt")
+        if os.path.exists(skipped_path):
+            with open(skipped_path, encoding="utf-8") as f:
+                skipped.extend(line.strip() for line in f if line.strip())
+        index_path = os.path.join(shard_dir, "id_index.json")
+        if os.path.exists(index_path):
+            ID_INDEX.update(IdIndex(index_path))
+        report_path = os.path.join(shard_dir, "run_report.json")
+        if os.path.exists(report_path):
+            with open(report_path, encoding="utf-8") as f:
+                reports.append(dict(json.load(f), shard=meta["index"]))
+        print(f"[merge] shard {meta['index']}: {len(rows['clinics'])} clinics from {shard_dir}")
+
+    clinics_rows, menus_rows, hours_rows = [], [], []
+    collect_rows(parts, clinics_rows, menus_rows, hours_rows)
+    if DISCOVERY_STATS.get("duplicate_clinic_rows"):
+        print(f"[merge] dropped {DISCOVERY_STATS['duplicate_clinic_rows']} clinics found by more than one shard")
+    if len(ceilings) > 1:
+        print(f"[merge warn] shards detected different ceilings: {sorted(ceilings)}")
+    if ceilings:
+        DISCOVERY_STATS.update(detected_ceiling=max(ceilings))
+        with open(os.path.join(out_dir, "_meta.txt"), "a", encoding="utf-8") as f:
+            f.write(f"detected_ceiling={DISCOVERY_STATS['detected_ceiling']}\n")
+
+    save_outputs(out_dir, clinics_rows, menus_rows, hours_rows, all_cards)
+    if skipped:
+        with open(os.path.join(out_dir, "skipped_urls.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(skipped) + "\n")
+    path = os.path.join(out_dir, "run_report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"finished_utc": now_utc_iso(), "shard_count": expected, "missing_shards": missing,
+                   "detected_ceiling": DISCOVERY_STATS.get("detected_ceiling"),
+                   "duplicate_clinic_rows": DISCOVERY_STATS.get("duplicate_clinic_rows", 0), "shards": reports}, f, ensure_ascii=False, indent=2)
+    print(f"[Saved] {path}")
+    ID_INDEX.save()   # 全シャード分の索引（plan ジョブの上限探索が使う）
+
+    # 欠けたシャードがあるまま Sheets を上書きすると、そのシャード分のクリニックが消えてしまう
+    if missing:
+        raise SystemExit(f"Missing shards {missing}: merged files saved under {out_dir}, Sheets not updated")
+    write_targets_sheet(urls)
     write_three_sheets(clinics_rows, menus_rows, hours_rows)
     write_settings_sheet()
 
+def print_ceiling():
+    """END_ID=auto の上限を1回だけ検出して detected_ceiling=NNNN を出す（plan ジョブで各シャードへ渡す）"""
+    _, end_id = resolve_id_range()
+    # 探索で確認した ID は merge ジョブが索引に取り込む（予算で打ち切っても次の Run がその先から探す）
+    ID_INDEX.save(os.path.join(os.getenv("OUTPUT_DIR", "output"), "ceiling", "id_index.json"))
+    print(f"detected_ceiling={end_id}")
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["merge"]:
+        merge_shards()
+    elif sys.argv[1:] == ["ceiling"]:
+        print_ceiling()
+    else:
+        try:
+            main()
+        finally:
+            ID_INDEX.save()   # 途中で終わっても、確認済みの ID と予算の持ち越しを次の Run に残す